@@ -0,0 +1,45 @@
+import threading
+import time
+
+ACCOUNT_TIMEOUT = 10
+
+
+# Account values, positions and PnL kept current by subscriptions opened once at connect.
+# Every change bumps `version` and stamps `updated_at` for its section, readers only wait
+# for the first download of a section, after that they read straight from memory.
+class AccountState:
+    def __init__(self):
+        self.account_values = {}
+        self.positions = {}
+        self.pnl = {}
+        self.version = 0
+        self.updated_at = {"account_values": None, "positions": None, "pnl": None}
+        self._ready = set()
+        self._cond = threading.Condition()
+
+    def update(self, section, key, value):
+        with self._cond:
+            getattr(self, section)[key] = value
+            self.version += 1
+            self.updated_at[section] = time.time()
+            if section == "pnl":
+                self._ready.add(("pnl", key))
+            self._cond.notify_all()
+
+    def mark_ready(self, *sections):
+        with self._cond:
+            for section in sections:
+                self._ready.add(section)
+                if self.updated_at[section] is None:
+                    self.updated_at[section] = time.time()
+            self._cond.notify_all()
+
+    def ready(self, section):
+        return section in self._ready
+
+    def wait(self, section, timeout=ACCOUNT_TIMEOUT):
+        if section in self._ready:
+            return
+        with self._cond:
+            if not self._cond.wait_for(lambda: section in self._ready, timeout):
+                raise TimeoutError(f"no {section} within {timeout} seconds")
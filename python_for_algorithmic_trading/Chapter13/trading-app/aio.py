@@ -0,0 +1,168 @@
+import asyncio
+import pandas as pd
+from utils import (
+        HISTORICAL_DATA_TIMEOUT,
+        CONTRACT_DETAILS_TIMEOUT,
+        ACCOUNT_PNL_ID,
+        contract_key
+)
+from market_data import MARKET_DATA_TIMEOUT
+from account_state import ACCOUNT_TIMEOUT
+
+# asyncio facade over a connected IBApp. Nothing here starts threads per call: request
+# futures completed on the EReader thread are wrapped with asyncio.wrap_future, and the
+# market data cache and tick streams wake the event loop through call_soon_threadsafe.
+# Only first-time waits on the account subscriptions and bar cache merges use the executor.
+#
+#     app = IBApp(...)
+#     aio = AsyncIBApp(app)
+#     data = await aio.historical_data_for_many([psx, ho, rb, cl], "1 W", "1 min")
+#     async for batch in aio.ticks([psx, cl]):
+#         ...
+class AsyncIBApp:
+    def __init__(self, app):
+        self.app = app
+        self._loop = None
+        self._market_waiters = {}
+        app.market_data.listeners.append(self._on_market_data)
+
+    def _get_loop(self):
+        if self._loop is None:
+            self._loop = asyncio.get_running_loop()
+        return self._loop
+
+    # --- historical data ---
+    async def historical_data(self, contract, duration, bar_size, what_to_show="MIDPOINT",
+                              timeout=HISTORICAL_DATA_TIMEOUT):
+        loop = self._get_loop()
+        request_id = self.app.next_request_id()
+        # the scheduler times the request out from when it is sent, see IBClient
+        future, fetch = self.app._submit_historical_data(
+                request_id, contract, duration, bar_size, what_to_show, timeout)
+        try:
+            data = await asyncio.wrap_future(future)
+        except asyncio.CancelledError:
+            self.app._cancel_historical_data(request_id, future)
+            raise
+        # merging into the bar cache touches disk, keep it off the loop
+        return await loop.run_in_executor(
+                None,
+                self.app._collect_historical_data,
+                request_id,
+                contract,
+                duration,
+                bar_size,
+                what_to_show,
+                fetch,
+                data,
+        )
+
+    async def historical_data_for_many(self, contracts, duration, bar_size, col_to_use="close",
+                                       what_to_show="MIDPOINT", timeout=HISTORICAL_DATA_TIMEOUT):
+        frames = await asyncio.gather(*(
+            self.historical_data(contract, duration, bar_size, what_to_show, timeout)
+            for contract in contracts
+        ))
+        data = pd.DataFrame({
+            contract.symbol: frame[col_to_use] for contract, frame in zip(contracts, frames)
+        })
+        data.index.name = "time"
+        data.columns.name = "symbol"
+        return data.sort_index(axis=1)
+
+    # --- market data ---
+    def _on_market_data(self, key, tick_type):
+        if self._loop is not None and key in self._market_waiters:
+            self._loop.call_soon_threadsafe(self._wake_market, key)
+
+    def _wake_market(self, key):
+        for event in self._market_waiters.get(key, ()):
+            event.set()
+
+    async def market_data(self, contract, tick_type=4, max_age=None,
+                          timeout=MARKET_DATA_TIMEOUT):
+        loop = self._get_loop()
+        self.app.subscribe_market_data(contract)
+        key = contract_key(contract)
+        deadline = loop.time() + timeout
+        event = asyncio.Event()
+        # register before checking so a tick landing in between still wakes us
+        self._market_waiters.setdefault(key, set()).add(event)
+        try:
+            while True:
+                event.clear()
+                try:
+                    return self.app.get_market_data(
+                            contract, tick_type, max_age=max_age, timeout=0)
+                except TimeoutError:
+                    pass
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    raise TimeoutError(
+                            f"no tick type {tick_type} for {key} within {timeout} seconds")
+                try:
+                    await asyncio.wait_for(event.wait(), remaining)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            waiters = self._market_waiters[key]
+            waiters.discard(event)
+            if not waiters:
+                del self._market_waiters[key]
+
+    # --- account ---
+    async def _wait_account(self, section, timeout):
+        if self.app.account_state.ready(section):
+            return
+        await self._get_loop().run_in_executor(
+                None, self.app.account_state.wait, section, timeout)
+
+    async def account_values(self, key=None, timeout=ACCOUNT_TIMEOUT):
+        self.app.start_account_updates()
+        await self._wait_account("account_values", timeout)
+        return self.app.get_account_values(key)
+
+    async def positions(self, timeout=ACCOUNT_TIMEOUT):
+        self.app.start_account_updates()
+        await self._wait_account("positions", timeout)
+        return self.app.get_positions()
+
+    async def pnl(self, request_id=ACCOUNT_PNL_ID, timeout=ACCOUNT_TIMEOUT):
+        self.app.start_pnl_updates(request_id)
+        await self._wait_account(("pnl", request_id), timeout)
+        return self.app.get_pnl(request_id)
+
+    # --- contracts ---
+    async def resolve_contract(self, contract, timeout=CONTRACT_DETAILS_TIMEOUT):
+        future, request_id = self.app._submit_contract_details(contract)
+        try:
+            details = await asyncio.wait_for(asyncio.wrap_future(future), timeout)
+        except asyncio.TimeoutError:
+            self.app.request_futures.pop(request_id, None)
+            raise
+        return self.app._collect_contract_details(contract, details)
+
+    async def resolve_contracts(self, contracts, timeout=CONTRACT_DETAILS_TIMEOUT):
+        return await asyncio.gather(*(
+            self.resolve_contract(contract, timeout) for contract in contracts
+        ))
+
+    # --- ticks ---
+    # merged, time-ordered tick batches for the contracts, see TickStream.take
+    async def ticks(self, contracts, max_items=None):
+        loop = self._get_loop()
+        stream = self.app.subscribe_ticks(contracts)
+        ready = asyncio.Event()
+        stream.on_ready = lambda: loop.call_soon_threadsafe(ready.set)
+        try:
+            while True:
+                ready.clear()
+                batch, closed = stream.take(max_items)
+                if batch is not None:
+                    yield batch
+                elif closed:
+                    return
+                else:
+                    await ready.wait()
+        finally:
+            stream.close()
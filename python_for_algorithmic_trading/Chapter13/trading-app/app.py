@@ -1,16 +1,25 @@
 import threading
 import time
-import sqlite3
 from wrapper import IBWrapper
 from client import IBClient
+from bar_cache import BarCache
+from contract_cache import ContractCache
+from tick_writer import TickWriter
+from sqlite_pool import ConnectionPool
+from journal import OrderJournal
+import tick_db
+from tick_codec import write_tick_file
+from tick_replay import save_replay_file
+from bar_rollup import BarRollup
+from timeseries_buffer import TimeSeriesBuffer
 import os
 from contract import stock, future, option, combo_leg, spread
 from order import market, limit, BUY, SELL
-import empyrical as ep
 from utils import (
-        CREATE_BID_ASK_DATA,
+        ACCOUNT_PNL_ID,
         CREATE_OPEN_ORDERS,
-        CREATE_TRADES
+        CREATE_TRADES,
+        STRATEGY_DATABASE
 )
 
 windows_host = os.getenv("WINDOWS_HOST")
@@ -18,17 +27,29 @@ windows_host = os.getenv("WINDOWS_HOST")
 class IBApp(IBWrapper, IBClient):
     def __init__(self, ip, port, client_id, account, interval=5, **kwargs):
         IBWrapper.__init__(self)
-        IBClient.__init__(self, wrapper=self)
+        IBClient.__init__(
+                self,
+                wrapper=self,
+                bar_cache=BarCache(),
+                contract_cache=ContractCache()
+        )
         self.account = account
+        self.db = ConnectionPool(STRATEGY_DATABASE)
         self.create_table()
+        self.tick_writer = TickWriter(STRATEGY_DATABASE)
+        self.journal = OrderJournal(STRATEGY_DATABASE)
+        self.bar_rollup = BarRollup(STRATEGY_DATABASE)
+        self.bar_rollup.start()
         self.connect(ip, port, client_id)
         
         threading.Thread(target=self.run, daemon=True).start()
+        self.start_account_updates()
+        self.start_pnl_updates(ACCOUNT_PNL_ID)
         
         time.sleep(2)
         threading.Thread(
             target=self.get_streaming_returns,
-            agrs=(99, interval, "unrealized_pnl"),
+            args=(ACCOUNT_PNL_ID, interval, "unrealized_pnl"),
             daemon=True
         ).start()
         
@@ -39,78 +60,125 @@ class IBApp(IBWrapper, IBClient):
                 daemon=True
         ).start()
 
+    # the calling thread's connection, see ConnectionPool
     @property
     def connection(self):
-        return sqlite3.connect("strategy_1.sqlite", isolation_level=None)
+        return self.db.connection()
     
+    # queued ticks and journal events are committed, and rolled up, before the pool closes
+    def disconnect(self):
+        super().disconnect()
+        self.tick_writer.flush()
+        self.bar_rollup.stop()
+        self.journal.flush()
+        self.db.close()
+
     def create_table(self):
         cursor = self.connection.cursor()
-        cursor.execute(CREATE_BID_ASK_DATA)
+        tick_db.migrate(self.connection)
         cursor.execute(CREATE_OPEN_ORDERS)
         cursor.execute(CREATE_TRADES)
 
-    def stream_to_sqlite(self, request_id, contract, run_for_in_seconds=23400):
-        cursor = self.connection.cursor()
+    # captured ticks of a symbol between start and end, or bars of them, see tick_db
+    def query_ticks(self, symbol, start, end, bar_size=None):
+        return tick_db.query_ticks(self.connection, symbol, start, end, bar_size)
+
+    # bars the background rollup keeps from captured ticks, see BarRollup
+    def query_bars(self, symbol, start, end, bar_size="1 min"):
+        return tick_db.query_bars(self.connection, symbol, start, end, bar_size)
+
+    # move captured ticks into a compressed file, read them back with tick_codec.read_tick_file
+    def archive_ticks(self, symbol, start, end, path, price_scale=100):
+        batch = tick_db.query_tick_array(self.connection, symbol, start, end)
+        write_tick_file(path, batch, price_scale)
+        return len(batch)
+
+    # captured ticks as a memory-mappable file for tick_replay.TickReplay
+    def export_replay(self, symbol, start, end, path):
+        batch = tick_db.query_tick_array(self.connection, symbol, start, end)
+        save_replay_file(path, batch)
+        return len(batch)
+
+    # ticks are handed to the background writer a batch at a time, see TickWriter; pass a
+    # ParquetTickStore as tick_store to capture into Parquet files instead of bid_ask_data.
+    # Returns what the writer's flush does, False from TickWriter when rows were lost
+    def stream_to_sqlite(self, request_id, contract, run_for_in_seconds=23400, tick_store=None):
+        writer = tick_store or self.tick_writer
         end_time = time.time() + run_for_in_seconds + 10
-        for tick in self.get_streaming_data(request_id, contract):
-            query = "INSERT INTO bid_ask_data (" \
-                "timestamp, symbol, bid_price, " \
-                "ask_price, bid_size, ask_size) " \
-                "VALUES (?, ?, ?, ?, ?, ?)"
-            values = (
-                    tick.timestamp_.strftime(
-                        "%Y-%m-%d %H:%M:%S"),
-                    contract.symbol,
-                    tick.bid_price,
-                    tick.ask_price,
-                    tick.bid_size,
-                    tick.ask_size
-            )
-            cursor.execute(query, values)
+        for batch in self.get_streaming_batches(request_id, contract, timeout=1):
+            writer.write(contract.symbol, batch)
             if time.time() >= end_time:
                 break
         self.stop_streaming_data(request_id)
+        return writer.flush()
     
+    # assigning a return series or buffer rebuilds the risk engine from it; streamed returns
+    # go to self.risk.update one at a time, reading gives a pandas view of the buffer
+    @property
+    def portfolio_returns(self):
+        if isinstance(self._portfolio_returns, TimeSeriesBuffer):
+            return self._portfolio_returns.series()
+        return self._portfolio_returns
+
+    @portfolio_returns.setter
+    def portfolio_returns(self, returns):
+        self._portfolio_returns = returns
+        self.risk.reset()
+        if isinstance(returns, TimeSeriesBuffer):
+            self.risk.extend(returns.values)
+        elif returns is not None:
+            self.risk.extend(returns)
+
+    # the risk properties read the incrementally kept state, see RiskEngine
     @property
     def cumulative_returns(self):
-        return ep.cum_returns(self.portfolio_returns, 1)
+        return self.risk.value
 
     @property
     def max_drawdown(self):
-        return ep.max_drawdown(self.portfolio_returns)
+        return self.risk.max_drawdown
     
     @property
     def volatility(self):
-        return self.portfolio_returns.std(ddof=1)
+        return self.risk.volatility
 
     @property
     def omega_ratio(self):
-        return ep.omega_ratio(self.portfolio_returns, annualization=1)
+        return self.risk.omega_ratio
     
     @property
     def sharpe_ratio(self):
-        return self.portfolio_returns.mean() / self.portfolio_returns.std(ddof=1)
+        return self.risk.sharpe_ratio
     
+    # from the account values the account subscription keeps current, no request is made
+    @property
+    def net_liquidation(self):
+        return self.get_account_values("NetLiquidation")[0]
+
     @property
     def cvar(self):
-        net_liquidation = self.get_account_values(
-            "Netliquidation")[0]
-        cvar_ = ep.conditional_value_at_risk(
-            self.portfolio_returns)
+        cvar_ = self.risk.cvar
         return(
             cvar_,
-            cvar_ * net_liquidation
+            cvar_ * self.net_liquidation
         )
     
+    # checked as soon as a return reaches the risk engine, and at least every interval
+    # seconds to follow changes in net liquidation; a failed check is retried on the next one
     def watch_cvar(self, threshold, interval):
-        print("Watching CVaR in 60 seconds...")
-        time.sleep(60)
+        print("Watching CVaR...")
+        version = self.risk.version
         while True:
-            cvar = self.cvar[1]
+            version = self.risk.wait(version, interval)
+            if not self.risk.ready:
+                continue
+            try:
+                cvar = self.cvar[1]
+            except Exception as exc:
+                print("CVaR check failed:", exc)
+                continue
             if cvar < threshold:
                 print(f"Portfolio CVaR ({cvar}) crossed threshold ({threshold})")
-                pass
-            time.sleep(interval)
 
 
 
@@ -153,7 +221,6 @@ if __name__ == "__main__":
     
     while True:
         data = app.get_historical_data_for_many(
-            request_id=99,
             contracts=[psx, ho, rb, cl],
             duration="1 W",
             bar_size="1 min",
@@ -0,0 +1,199 @@
+import math
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta
+
+BAR_CACHE_PATH = "bar_cache.sqlite"
+# entries not read for this long are dropped
+BAR_CACHE_MAX_AGE = 7 * 24 * 3600
+# least recently used entries are dropped once the cache holds more bars than this
+BAR_CACHE_MAX_ROWS = 5_000_000
+# kept in PRAGMA user_version; version 0 declared the columns STRING, whose NUMERIC affinity
+# turned daily bar dates into integers, such caches are dropped and refilled
+BAR_CACHE_SCHEMA_VERSION = 1
+
+CREATE_BARS = """
+    CREATE TABLE IF NOT EXISTS bars
+    (
+        key TEXT NOT NULL,
+        time TEXT NOT NULL,
+        open REAL,
+        high REAL,
+        low REAL,
+        close REAL,
+        volume REAL,
+        PRIMARY KEY (key, time)
+    ) WITHOUT ROWID"""
+
+CREATE_BAR_ENTRIES = """
+    CREATE TABLE IF NOT EXISTS bar_entries
+    (
+        key TEXT PRIMARY KEY,
+        covered_seconds INTEGER,
+        last_time TEXT,
+        fetched_at REAL,
+        accessed_at REAL,
+        rows INTEGER
+    )"""
+
+DURATION_UNITS = {"S": 1, "D": 86400, "W": 7 * 86400, "M": 31 * 86400, "Y": 366 * 86400}
+BAR_SIZE_UNITS = {
+    "sec": 1, "min": 60, "hour": 3600, "day": 86400, "week": 7 * 86400, "month": 31 * 86400
+}
+
+
+def duration_seconds(duration):
+    value, unit = duration.split()
+    return int(value) * DURATION_UNITS[unit]
+
+
+def bar_size_seconds(bar_size):
+    value, unit = bar_size.split()
+    return int(value) * BAR_SIZE_UNITS[unit.rstrip("s")]
+
+
+# IB only accepts durations in seconds up to one day
+def seconds_to_duration(seconds, bar_size):
+    if seconds <= 86400 and bar_size_seconds(bar_size) < 86400:
+        return f"{int(seconds)} S"
+    return f"{max(1, math.ceil(seconds / 86400))} D"
+
+
+# bar dates come back as "%Y%m%d" or "%Y%m%d %H:%M:%S <tz>", both sort as strings
+def _parse_bar_time(value):
+    if len(value) >= 17:
+        return datetime.strptime(value[:17], "%Y%m%d %H:%M:%S")
+    return datetime.strptime(value[:8], "%Y%m%d")
+
+
+def _format_bar_time(value, like):
+    if len(like) >= 17:
+        return value.strftime("%Y%m%d %H:%M:%S")
+    return value.strftime("%Y%m%d")
+
+
+# Local store of historical bars keyed by contract, bar size and whatToShow. `plan` tells
+# the client which duration is still missing, `merge` stores what came back and returns
+# the bars covering the requested duration. Eviction runs after every merge.
+class BarCache:
+    def __init__(self, path=BAR_CACHE_PATH, max_age=BAR_CACHE_MAX_AGE, max_rows=BAR_CACHE_MAX_ROWS):
+        self.max_age = max_age
+        self.max_rows = max_rows
+        self.hits = 0
+        self.misses = 0
+        self.gap_fills = 0
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        with self._connection:
+            version = self._connection.execute("PRAGMA user_version").fetchone()[0]
+            if version < BAR_CACHE_SCHEMA_VERSION:
+                self._connection.execute("DROP TABLE IF EXISTS bars")
+                self._connection.execute("DROP TABLE IF EXISTS bar_entries")
+                self._connection.execute(f"PRAGMA user_version = {BAR_CACHE_SCHEMA_VERSION}")
+            self._connection.execute(CREATE_BARS)
+            self._connection.execute(CREATE_BAR_ENTRIES)
+
+    @staticmethod
+    def key(contract_key, bar_size, what_to_show):
+        return f"{contract_key}|{bar_size}|{what_to_show}"
+
+    @property
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "gap_fills": self.gap_fills}
+
+    def _entry(self, key):
+        return self._connection.execute(
+                "SELECT covered_seconds, last_time, fetched_at FROM bar_entries WHERE key = ?",
+                (key,)
+        ).fetchone()
+
+    # returns the duration to request from IB, or None when the cache is up to date
+    def plan(self, key, duration, bar_size):
+        with self._lock:
+            entry = self._entry(key)
+        if entry is None:
+            self.misses += 1
+            return duration
+        covered_seconds, last_time, fetched_at = entry
+        # the last full download was for a shorter duration
+        if duration_seconds(duration) > covered_seconds:
+            self.misses += 1
+            return duration
+
+        now = time.time()
+        bar_seconds = bar_size_seconds(bar_size)
+        # no bar has closed since the last fetch
+        if now // bar_seconds == fetched_at // bar_seconds:
+            self.hits += 1
+            return None
+        # one bar of overlap so a bar still forming at the last fetch gets overwritten
+        gap = now - fetched_at + bar_seconds
+        if gap >= duration_seconds(duration):
+            self.misses += 1
+            return duration
+        self.gap_fills += 1
+        return seconds_to_duration(gap, bar_size)
+
+    # bars is None on a cache hit, full is True when the whole duration was downloaded again
+    def merge(self, key, bars, duration, full=False):
+        now = time.time()
+        with self._lock, self._connection:
+            entry = self._entry(key)
+            if full:
+                self._connection.execute("DELETE FROM bars WHERE key = ?", (key,))
+            if bars:
+                self._connection.executemany(
+                        "INSERT OR REPLACE INTO bars VALUES (?, ?, ?, ?, ?, ?, ?)",
+                        [(key, bar[0], *map(float, bar[1:])) for bar in bars]
+                )
+            last_time, count = self._connection.execute(
+                    "SELECT MAX(time), COUNT(*) FROM bars WHERE key = ?", (key,)
+            ).fetchone()
+            if last_time is None:
+                self._connection.execute("DELETE FROM bar_entries WHERE key = ?", (key,))
+                return []
+            if full or entry is None:
+                covered_seconds = duration_seconds(duration)
+            else:
+                covered_seconds = entry[0]
+            fetched_at = entry[2] if bars is None else now
+            self._connection.execute(
+                    "INSERT OR REPLACE INTO bar_entries VALUES (?, ?, ?, ?, ?, ?)",
+                    (key, covered_seconds, last_time, fetched_at, now, count)
+            )
+            cutoff = _format_bar_time(
+                    _parse_bar_time(last_time) - timedelta(seconds=duration_seconds(duration)),
+                    last_time
+            )
+            rows = self._connection.execute(
+                    "SELECT time, open, high, low, close, volume FROM bars "
+                    "WHERE key = ? AND time >= ? ORDER BY time",
+                    (key, cutoff)
+            ).fetchall()
+        self.evict()
+        return rows
+
+    def evict(self):
+        now = time.time()
+        with self._lock, self._connection:
+            stale = self._connection.execute(
+                    "SELECT key FROM bar_entries WHERE accessed_at < ?",
+                    (now - self.max_age,)
+            ).fetchall()
+            entries = self._connection.execute(
+                    "SELECT key, rows FROM bar_entries ORDER BY accessed_at DESC"
+            ).fetchall()
+            total = 0
+            for key, rows in entries:
+                total += rows
+                if total > self.max_rows:
+                    stale.append((key,))
+            for (key,) in stale:
+                self._connection.execute("DELETE FROM bars WHERE key = ?", (key,))
+                self._connection.execute("DELETE FROM bar_entries WHERE key = ?", (key,))
+        return len(stale)
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
@@ -0,0 +1,160 @@
+import threading
+import numpy as np
+import tick_db
+from bar_cache import bar_size_seconds
+from sqlite_pool import open_connection
+from utils import STRATEGY_DATABASE
+
+ROLLUP_BAR_SIZES = ("1 sec", "1 min", "1 hour")
+# ticks read from bid_ask_data per transaction
+ROLLUP_CHUNK = 200_000
+ROLLUP_INTERVAL = 1.0
+
+SELECT_NEW_TICKS = """
+    SELECT rowid, ts, symbol, bid_price, ask_price
+    FROM bid_ask_data
+    WHERE rowid > ?
+    ORDER BY rowid
+    LIMIT ?"""
+
+# a bar that already exists is merged with the new part of it: open and close follow
+# whichever side has the earlier first and later last tick, the spread is tick weighted
+UPSERT_BAR = """
+    INSERT INTO tick_bars
+        (symbol, resolution, ts, open, high, low, close, spread, spread_max, ticks,
+         first_ts, last_ts)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT (symbol, resolution, ts) DO UPDATE SET
+        open = CASE WHEN excluded.first_ts < first_ts THEN excluded.open ELSE open END,
+        close = CASE WHEN excluded.last_ts >= last_ts THEN excluded.close ELSE close END,
+        high = MAX(high, excluded.high),
+        low = MIN(low, excluded.low),
+        spread = (spread * ticks + excluded.spread * excluded.ticks)
+            / (ticks + excluded.ticks),
+        spread_max = MAX(spread_max, excluded.spread_max),
+        ticks = ticks + excluded.ticks,
+        first_ts = MIN(first_ts, excluded.first_ts),
+        last_ts = MAX(last_ts, excluded.last_ts)"""
+
+UPDATE_WATERMARK = """
+    INSERT INTO rollup_state (name, last_rowid) VALUES (?, ?)
+    ON CONFLICT (name) DO UPDATE SET last_rowid = excluded.last_rowid"""
+
+
+# midpoint OHLC and spread bars per symbol and bucket of `resolution` nanoseconds
+def rollup(ts, symbols, mid, spread, resolution):
+    buckets = ts // resolution
+    order = np.lexsort((ts, buckets, symbols))
+    ts, symbols, mid, spread, buckets = (
+            ts[order], symbols[order], mid[order], spread[order], buckets[order])
+    starts = np.flatnonzero(
+            np.r_[True, (symbols[1:] != symbols[:-1]) | (buckets[1:] != buckets[:-1])])
+    ends = np.r_[starts[1:], len(ts)] - 1
+    ticks = np.diff(np.r_[starts, len(ts)])
+    return {
+        "symbol": symbols[starts],
+        "ts": buckets[starts] * resolution,
+        "open": mid[starts],
+        "high": np.maximum.reduceat(mid, starts),
+        "low": np.minimum.reduceat(mid, starts),
+        "close": mid[ends],
+        "spread": np.add.reduceat(spread, starts) / ticks,
+        "spread_max": np.maximum.reduceat(spread, starts),
+        "ticks": ticks,
+        "first_ts": ts[starts],
+        "last_ts": ts[ends],
+    }
+
+
+# Keeps tick_bars current from the ticks appended to bid_ask_data. Progress is the last
+# bid_ask_data rowid rolled up, committed together with the bars it produced, so after a
+# restart the rollup resumes exactly where it stopped.
+class BarRollup:
+    def __init__(
+            self,
+            path=STRATEGY_DATABASE,
+            bar_sizes=ROLLUP_BAR_SIZES,
+            chunk=ROLLUP_CHUNK,
+            name="bid_ask_data"
+    ):
+        self.path = path
+        self.resolutions = [bar_size_seconds(bar_size) for bar_size in bar_sizes]
+        self.chunk = chunk
+        self.name = name
+        self.ticks_rolled_up = 0
+        self._connection = open_connection(path)
+        tick_db.migrate(self._connection)
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def watermark(self):
+        row = self._connection.execute(
+                "SELECT last_rowid FROM rollup_state WHERE name = ?", (self.name,)).fetchone()
+        return 0 if row is None else row[0]
+
+    # roll up everything written so far, returns the number of ticks processed
+    def run_once(self):
+        total = 0
+        with self._lock:
+            while True:
+                rows = self._connection.execute(
+                        SELECT_NEW_TICKS, (self.watermark, self.chunk)).fetchall()
+                if not rows:
+                    break
+                self._roll_up(rows)
+                total += len(rows)
+                if len(rows) < self.chunk:
+                    break
+        self.ticks_rolled_up += total
+        return total
+
+    def _roll_up(self, rows):
+        rowid, ts, symbols, bid, ask = (np.array(column) for column in zip(*rows))
+        ts = ts.astype(np.int64)
+        bid = bid.astype(np.float64)
+        ask = ask.astype(np.float64)
+        mid = (bid + ask) / 2
+        spread = ask - bid
+        with self._connection:
+            for resolution in self.resolutions:
+                bars = rollup(ts, symbols, mid, spread, resolution * 1_000_000_000)
+                self._connection.executemany(UPSERT_BAR, zip(
+                        bars["symbol"].tolist(),
+                        [resolution] * len(bars["ts"]),
+                        bars["ts"].tolist(),
+                        bars["open"].tolist(),
+                        bars["high"].tolist(),
+                        bars["low"].tolist(),
+                        bars["close"].tolist(),
+                        bars["spread"].tolist(),
+                        bars["spread_max"].tolist(),
+                        bars["ticks"].tolist(),
+                        bars["first_ts"].tolist(),
+                        bars["last_ts"].tolist(),
+                ))
+            self._connection.execute(UPDATE_WATERMARK, (self.name, int(rowid.max())))
+
+    # keep rolling up in the background every `interval` seconds
+    def start(self, interval=ROLLUP_INTERVAL):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, args=(interval,), daemon=True)
+        self._thread.start()
+
+    def _run(self, interval):
+        while not self._stop.is_set():
+            try:
+                self.run_once()
+            except Exception as exc:
+                print("Rollup error:", exc)
+            self._stop.wait(interval)
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.run_once()
@@ -0,0 +1,141 @@
+import queue
+import threading
+import time
+from collections import deque
+from sqlite_pool import open_connection
+
+# commit errors kept for inspection, older ones are dropped
+BATCH_WORKER_MAX_ERRORS = 100
+
+
+class _Flush:
+    def __init__(self):
+        self.done = threading.Event()
+        self.ok = True
+
+
+# Background thread committing queued items to SQLite in batches, once batch_size of them
+# are pending, flush_interval has passed since the first one or a flush asks for it.
+# Subclasses implement _commit(connection, items) and _size(item). A failing commit never
+# stops the thread: the error goes to `errors`, the items are kept and retried after
+# flush_interval when `retry` is set and dropped otherwise, and the next flush returns False.
+class BatchWorker:
+    retry = False
+
+    def __init__(self, path, batch_size, flush_interval, max_queue=0, pragmas=()):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.items_written = 0
+        self.items_dropped = 0
+        self.transactions = 0
+        self.failed_commits = 0
+        self.busy_seconds = 0.0
+        self.errors = deque(maxlen=BATCH_WORKER_MAX_ERRORS)
+        self._pending = 0
+        self._failed = False
+        self._lock = threading.Lock()
+        self._connection = open_connection(path)
+        for pragma in pragmas:
+            self._connection.execute(pragma)
+        self._queue = queue.Queue(max_queue)
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _size(self, item):
+        return 1
+
+    def _commit(self, connection, items):
+        raise NotImplementedError
+
+    def _put(self, item):
+        if self._closed:
+            raise RuntimeError(f"{type(self).__name__} is closed")
+        with self._lock:
+            self._pending += self._size(item)
+        self._queue.put(item)
+
+    # items handed over but not committed yet
+    @property
+    def queue_depth(self):
+        return self._pending
+
+    @property
+    def last_error(self):
+        return self.errors[-1] if self.errors else None
+
+    # True once everything queued before the call is committed; False on timeout, or when
+    # a commit failed since the previous flush
+    def flush(self, timeout=None):
+        if self._closed:
+            return not self._failed
+        waiter = _Flush()
+        self._queue.put(waiter)
+        return waiter.done.wait(timeout) and waiter.ok
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(None)
+        self._thread.join()
+
+    def _run(self):
+        connection = self._connection
+        items = []
+        size = 0
+        waiting = []
+        deadline = None
+        stop = False
+        while not stop:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = ()
+            if item is None:
+                stop = True
+            elif isinstance(item, _Flush):
+                waiting.append(item)
+            elif item:
+                items.append(item)
+                size += self._size(item)
+                if deadline is None:
+                    deadline = time.monotonic() + self.flush_interval
+            if items and (stop or waiting or size >= self.batch_size
+                          or time.monotonic() >= deadline):
+                committed = self._try_commit(connection, items)
+                if committed or not self.retry:
+                    if committed:
+                        self.items_written += size
+                    else:
+                        self.items_dropped += size
+                    with self._lock:
+                        self._pending -= size
+                    items = []
+                    size = 0
+                    deadline = None
+                else:
+                    deadline = time.monotonic() + self.flush_interval
+            for waiter in waiting:
+                waiter.ok = not self._failed
+                waiter.done.set()
+            if waiting:
+                self._failed = False
+                waiting = []
+        connection.close()
+
+    def _try_commit(self, connection, items):
+        start = time.perf_counter()
+        try:
+            self._commit(connection, items)
+        except Exception as exc:
+            self.errors.append(exc)
+            self.failed_commits += 1
+            self._failed = True
+            print(f"{type(self).__name__} error:", exc)
+            return False
+        self.busy_seconds += time.perf_counter() - start
+        self.transactions += 1
+        return True
@@ -0,0 +1,349 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from dataclasses import dataclass, field
+import empyrical as ep
+import numpy as np
+import pandas as pd
+from app import IBApp
+from bar_cache import BarCache
+from contract import stock
+from fake_tws import FakeTWS, FAKE_ACCOUNT
+from order import market, BUY
+from pacing import HistoricalScheduler
+from tail_risk import StreamingCVaR
+from tick_writer import TickWriter
+from timeseries_buffer import TimeSeriesBuffer
+from utils import TICK_DTYPE, Tick
+
+# Latency and throughput of the trading-app hot paths against the in-process fake TWS,
+# no network needed:
+#
+#     python benchmarks.py --json results.json
+#     python benchmarks.py --baseline results.json --tolerance 0.25
+#
+# With --baseline the run exits with status 1 when any metric is worse than the baseline
+# by more than the tolerance. Metrics ending in _per_s are better higher, the rest lower.
+
+
+class FakeIBApp(FakeTWS, IBApp):
+    pass
+
+
+def percentiles(samples, prefix):
+    samples = np.asarray(samples) * 1e3
+    return {
+        f"{prefix}_p50_ms": float(np.percentile(samples, 50)),
+        f"{prefix}_p99_ms": float(np.percentile(samples, 99)),
+    }
+
+
+def bench_historical(app, requests):
+    # the fake has no pacing limits, keep the scheduler from spacing out repeated requests
+    app.historical_scheduler = HistoricalScheduler(
+            app._request_historical_data,
+            app._expire_historical_data,
+            max_requests=sys.maxsize,
+            identical_interval=0,
+            same_contract_max=sys.maxsize,
+            max_open=sys.maxsize,
+    )
+    app.bar_cache = None
+    single = []
+    for i in range(requests):
+        start = time.perf_counter()
+        app.get_historical_data(None, stock(f"H{i}", "SMART", "USD"), "1 D", "1 min")
+        single.append(time.perf_counter() - start)
+    many = []
+    for i in range(max(1, requests // 10)):
+        contracts = [stock(f"M{i}_{j}", "SMART", "USD") for j in range(50)]
+        start = time.perf_counter()
+        app.get_historical_data_for_many(contracts, "1 D", "1 min")
+        many.append(time.perf_counter() - start)
+    return {
+        **percentiles(single, "historical.single"),
+        **percentiles(many, "historical.many_50"),
+    }
+
+
+# daily bars through the bar cache: a full download, a cache hit and a gap fill must all
+# give back the same frame
+def bench_bar_cache(app, requests):
+    app.bar_cache = BarCache("bench_bar_cache.sqlite")
+    contract = stock("DAILY", "SMART", "USD")
+    start = time.perf_counter()
+    full = app.get_historical_data(None, contract, "1 Y", "1 day")
+    cold = time.perf_counter() - start
+    cached = []
+    for _ in range(requests):
+        start = time.perf_counter()
+        hit = app.get_historical_data(None, contract, "1 Y", "1 day")
+        cached.append(time.perf_counter() - start)
+    app.bar_cache._connection.execute("UPDATE bar_entries SET fetched_at = fetched_at - 172800")
+    filled = app.get_historical_data(None, contract, "1 Y", "1 day")
+    for frame in (hit, filled):
+        if not frame.drop(columns="symbol").equals(full.drop(columns="symbol")):
+            raise AssertionError("daily bars changed on the way through the bar cache")
+    app.bar_cache.close()
+    app.bar_cache = None
+    return {
+        "bar_cache.daily_cold_ms": cold * 1e3,
+        **percentiles(cached, "bar_cache.daily_hit"),
+    }
+
+
+def bench_streaming(app, ticks):
+    app.configure(tick_rate=None, ticks_per_subscription=ticks)
+    results = {}
+    for name, per_tick in (("batches", False), ("ticks", True)):
+        request_id = app.next_request_id()
+        contract = stock(f"S{request_id}", "SMART", "USD")
+        received = 0
+        start = time.perf_counter()
+        if per_tick:
+            stream = app.get_streaming_data(request_id, contract)
+            for _ in stream:
+                received += 1
+                if received >= ticks:
+                    break
+        else:
+            for batch in app.get_streaming_batches(request_id, contract):
+                received += len(batch)
+                if received >= ticks:
+                    break
+        elapsed = time.perf_counter() - start
+        app.stop_streaming_data(request_id)
+        results[f"streaming.{name}_per_s"] = received / elapsed
+    app.configure()
+    return results
+
+
+# the tick type stream_to_sqlite used to build per tick, with its timestamp conversion
+@dataclass
+class LegacyTick:
+    time: int
+    bid_price: float
+    ask_price: float
+    bid_size: float
+    ask_size: float
+    ts: int = 0
+    timestamp_: pd.Timestamp = field(init=False)
+
+    def __post_init__(self):
+        self.timestamp_ = pd.to_datetime(self.time, unit="s")
+        self.bid_price = float(self.bid_price)
+        self.ask_price = float(self.ask_price)
+        self.bid_size = int(self.bid_size)
+        self.ask_size = int(self.ask_size)
+
+
+def legacy_capture(batch):
+    ticks = [LegacyTick(*row) for row in batch.tolist()]
+    for tick in ticks:
+        tick.timestamp_.strftime("%Y-%m-%d %H:%M:%S")
+    return ticks
+
+
+# per-tick cost of the old dataclass path, of Tick and of keeping the TICK_DTYPE batch
+def bench_tick_records(count):
+    batch = np.zeros(count, dtype=TICK_DTYPE)
+    batch["time"] = int(time.time()) + np.arange(count) // 1000
+    results = {}
+    for name, capture in (
+            ("legacy", legacy_capture),
+            ("tick", lambda batch: list(map(Tick._make, batch.tolist()))),
+            ("batch", np.copy),
+    ):
+        start = time.perf_counter()
+        capture(batch)
+        elapsed = time.perf_counter() - start
+        tracemalloc.start()
+        kept = capture(batch)
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        del kept
+        results[f"ticks.{name}_ns_per_tick"] = elapsed / count * 1e9
+        results[f"ticks.{name}_bytes_per_tick"] = size / count
+    return results
+
+
+def bench_tick_writer(rows, batch_size=1000):
+    batch = np.zeros(batch_size, dtype=TICK_DTYPE)
+    batch["time"] = int(time.time())
+    batch["bid_price"] = 99.99
+    batch["ask_price"] = 100.01
+    writer = TickWriter()
+    start = time.perf_counter()
+    for _ in range(rows // batch_size):
+        writer.write("BENCH", batch)
+    writer.flush()
+    elapsed = time.perf_counter() - start
+    writer.close()
+    return {"tick_writer.rows_per_s": writer.rows_written / elapsed}
+
+
+def bench_orders(app, orders):
+    contract = stock("ORD", "SMART", "USD")
+    start = time.perf_counter()
+    order_ids = [app.send_order(contract, market(BUY, 1)) for _ in range(orders)]
+    submitted = time.perf_counter() - start
+    while any(order_id in app.open_orders for order_id in order_ids):
+        time.sleep(0.001)
+    filled = time.perf_counter() - start
+    app.journal.flush()
+    journaled = time.perf_counter() - start
+    # the fake delivers openOrder/orderStatus and execDetails/orderStatus as one callback each
+    count, total, _ = np.sum(
+            [app.loop_stats.by_message[name] for name in ("_fake_submitted", "_fake_filled")],
+            axis=0)
+    return {
+        "orders.submit_per_s": orders / submitted,
+        "orders.fill_all_ms": filled * 1e3,
+        "orders.journaled_ms": journaled * 1e3,
+        "loop.order_callback_mean_us": total / count * 1e6,
+    }
+
+
+def bench_risk(app, returns, repeat):
+    rng = np.random.default_rng(0)
+    app.portfolio_returns = pd.Series(
+            rng.normal(0, 0.01, returns),
+            index=pd.date_range("2024-01-01", periods=returns, freq="s"))
+    results = {}
+    for name in (
+            "cumulative_returns", "max_drawdown", "volatility", "omega_ratio", "sharpe_ratio",
+            "cvar"):
+        start = time.perf_counter()
+        for _ in range(repeat):
+            getattr(app, name)
+        results[f"risk.{name}_us"] = (time.perf_counter() - start) / repeat * 1e6
+    start = time.perf_counter()
+    for value in app.portfolio_returns.tolist():
+        app.risk.update(value)
+    results["risk.update_us"] = (time.perf_counter() - start) / returns * 1e6
+    buffer = TimeSeriesBuffer(returns // 2)
+    start = time.perf_counter()
+    for timestamp, value in app.portfolio_returns.items():
+        buffer.append(timestamp, value)
+    results["returns.append_us"] = (time.perf_counter() - start) / returns * 1e6
+    start = time.perf_counter()
+    for _ in range(repeat):
+        buffer.series()
+    results["returns.series_us"] = (time.perf_counter() - start) / repeat * 1e6
+    results["risk.alert_latency_ms"] = bench_alert_latency(app, repeat)
+    return results
+
+
+# median absolute error of the streamed CVaR against empyrical's over N(0, 1%) returns, at
+# session lengths and past the point the P-square estimate takes over
+def bench_cvar_accuracy(lengths=(200, 1000, 2000, 20_000), samples=10):
+    results = {}
+    for length in lengths:
+        errors = []
+        for seed in range(samples):
+            returns = np.random.default_rng(seed).normal(0, 0.01, length)
+            cvar = StreamingCVaR()
+            for value in returns.tolist():
+                cvar.update(value)
+            errors.append(abs(cvar.cvar / ep.conditional_value_at_risk(returns) - 1))
+        results[f"risk.cvar_error_pct_{length}"] = float(np.median(errors)) * 100
+    return results
+
+
+# time from a return reaching the risk engine to a watcher, woken the way watch_cvar is,
+# having the new dollar CVaR
+def bench_alert_latency(app, repeat):
+    seen = []
+    version = app.risk.version
+
+    def watch():
+        nonlocal version
+        for _ in range(repeat):
+            version = app.risk.wait(version, 1)
+            app.cvar
+            seen.append(time.perf_counter())
+
+    latencies = []
+    watcher = threading.Thread(target=watch)
+    watcher.start()
+    for i in range(repeat):
+        start = time.perf_counter()
+        app.risk.update(-0.05)
+        while len(seen) <= i:
+            time.sleep(0)
+        latencies.append(seen[i] - start)
+    watcher.join()
+    return float(np.median(latencies)) * 1e3
+
+
+def compare(results, baseline, tolerance):
+    regressions = []
+    for name, value in results.items():
+        if name not in baseline:
+            continue
+        before = baseline[name]
+        if name.endswith("_per_s"):
+            worse = value < before * (1 - tolerance)
+        else:
+            worse = value > before * (1 + tolerance)
+        if worse:
+            regressions.append((name, before, value))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--baseline", help="compare against results written earlier")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    parser.add_argument("--quick", action="store_true", help="smaller sample sizes")
+    args = parser.parse_args(argv)
+    scale = 10 if args.quick else 1
+
+    background_errors = []
+    threading.excepthook = lambda hook_args: background_errors.append(hook_args.exc_value)
+    workdir = tempfile.mkdtemp(prefix="trading-app-bench-")
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        # the app prints every callback, keep that out of the report
+        with contextlib.redirect_stdout(io.StringIO()):
+            app = FakeIBApp("fake", 0, 1, FAKE_ACCOUNT, cvar_threshold=-500)
+            results = {}
+            results.update(bench_historical(app, 200 // scale))
+            results.update(bench_bar_cache(app, 100 // scale))
+            results.update(bench_streaming(app, 1_000_000 // scale))
+            results.update(bench_tick_records(200_000 // scale))
+            results.update(bench_tick_writer(1_000_000 // scale))
+            results.update(bench_orders(app, 5_000 // scale))
+            results.update(bench_risk(app, 20_000 // scale, 100 // scale))
+            results.update(bench_cvar_accuracy(samples=10 // scale or 1))
+            app.disconnect()
+    finally:
+        os.chdir(cwd)
+    results["background_errors"] = len(background_errors)
+
+    width = max(len(name) for name in results)
+    for name, value in results.items():
+        print(f"{name:<{width}}  {value:>14,.3f}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for name, before, after in regressions:
+            print(f"REGRESSION {name}: {before:,.3f} -> {after:,.3f}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,13 +1,52 @@
 from ibapi.client import EClient
+# before Python 3.11 future timeouts are not the builtin TimeoutError
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError, as_completed
+from itertools import count
 import time
-from utils import Tick, TRADE_BAR_PROPERTIES, DEFAULT_MARKET_DATA_ID
+from utils import (
+        Tick,
+        TRADE_BAR_PROPERTIES,
+        HISTORICAL_DATA_TIMEOUT,
+        CONTRACT_DETAILS_TIMEOUT,
+        REQUEST_ID_START,
+        ACCOUNT_PNL_ID,
+        IBError,
+        contract_key,
+        parse_bar_times
+)
+from pacing import HistoricalScheduler, request_pacing
+from bar_cache import BarCache
+from live_bars import LiveBars
+from market_data import MARKET_DATA_TIMEOUT
+from account_state import ACCOUNT_TIMEOUT
+from ring_buffer import TickRingBuffer, TICK_BUFFER_CAPACITY
+from tick_stream import TickStream
+from loop_stats import LoopStats
+from timeseries_buffer import TimeSeriesBuffer, TIMESERIES_CAPACITY
+import numpy as np
 import pandas as pd
 
 # Imports a base class from the IB API and impletments a custom class we'll use to build our traing app:
 class IBClient(EClient):
-    def __init__(self, wrapper):
+    def __init__(self, wrapper, bar_cache=None, contract_cache=None):
         EClient.__init__(self, wrapper)
-        self.market_data = {}
+        self.bar_cache = bar_cache
+        self.contract_cache = contract_cache
+        self._account_updates_started = False
+        self._pnl_request_ids = set()
+        self._request_ids = count(REQUEST_ID_START)
+        self.historical_scheduler = HistoricalScheduler(
+                self._request_historical_data, self._expire_historical_data)
+        self.loop_stats = LoopStats()
+
+    # time every message the loop hands to a callback, see LoopStats
+    def connect(self, host, port, client_id):
+        super().connect(host, port, client_id)
+        if getattr(self, "decoder", None) is not None:
+            self.decoder.interpret = self.loop_stats.timed(self.decoder.interpret)
+
+    def next_request_id(self):
+        return next(self._request_ids)
    
     def cancel_all_orders(self):
         self.reqGlobalCancel()
@@ -19,10 +58,11 @@ class IBClient(EClient):
         self.cancel_order_by_id(order_id)
         return self.send_order(contract, order)
 
+    # ids come from the local sequence, so orders can go out back to back
     def send_order(self, contract, order):
-        order_id = self.wrapper.nextValidOrderId
+        order_id = self.order_ids.allocate(contract, order)
+        self._track_order(order_id, contract, order)
         self.placeOrder(orderId=order_id, contract=contract, order=order)
-        self.reqIds(-1)
         return order_id
 
     # --------- Chapter12 Sending orders based on portfolio targets ---------
@@ -75,12 +115,8 @@ class IBClient(EClient):
     
     # the helper method
     def _calculate_order_value_quantity(self, contract, value):
-        last_price = self.get_market_data(
-            request_id=DEFAULT_MARKET_DATA_ID,
-            contract=contract, 
-            tick_type=4
-        )
-        multiplier = contract.multiplier if contract.multiplier != "" else 1
+        last_price = self.get_market_data(contract=contract, tick_type=4)
+        multiplier = float(contract.multiplier) if contract.multiplier != "" else 1
         return int(value / (last_price * multiplier))
     
     # same as the order_target_quantity but based on percent
@@ -97,73 +133,245 @@ class IBClient(EClient):
         target_quantity = self._calculate_order_percent_quantity(contract, target)
         return self._calculate_order_target_quantity(contract, target_quantity)
     
+    # Rebalance a whole basket to target weights of net liquidation in one pass: account,
+    # positions and prices are read once, every quantity is computed together and netted
+    # against what open orders will already buy or sell, then the batch is sent.
+    def rebalance(self, targets, order_type, **kwargs):
+        contracts = list(targets)
+        for contract in contracts:
+            self.subscribe_market_data(contract)
+        net_liquidation_value = self.get_account_values(key="NetLiquidation")[0]
+        positions = self.get_positions()
+        pending = {}
+        for tracked in list(self.open_orders.values()):
+            pending[tracked["symbol"]] = pending.get(tracked["symbol"], 0) + tracked["remaining"]
+
+        weights = np.array([targets[contract] for contract in contracts], dtype=float)
+        prices = np.array(
+                [self.get_market_data(contract=contract, tick_type=4) for contract in contracts])
+        multipliers = np.array(
+                [float(c.multiplier) if c.multiplier != "" else 1.0 for c in contracts])
+        current = np.array(
+                [positions.get(c.symbol, {}).get("position", 0) for c in contracts], dtype=float)
+        in_flight = np.array([pending.get(c.symbol, 0) for c in contracts])
+
+        target_quantities = np.trunc(weights * net_liquidation_value / (prices * multipliers))
+        quantities = (target_quantities - current - in_flight).astype(int)
+
+        order_ids = {}
+        for contract, quantity in zip(contracts, quantities):
+            if quantity == 0:
+                continue
+            order = order_type(
+                action="SELL" if quantity < 0 else "BUY",
+                quantity=abs(int(quantity)),
+                **kwargs
+            )
+            order_ids[contract.symbol] = self.send_order(contract, order)
+        return order_ids
+
     # --------------------------------------------------------------
     
+    # each request id gets a future the wrapper completes on the end or error callback
+    def _register_request(self, request_id):
+        future = Future()
+        self.request_futures[request_id] = future
+        return future
+
     # historical data
-    def get_historical_data(self, request_id, contract, duration, bar_size):
+    def _request_historical_data(self, request_id, contract, duration, bar_size,
+                                 what_to_show="MIDPOINT", keep_up_to_date=False):
+        self.historical_data[request_id] = []
+        future = self._register_request(request_id)
         self.reqHistoricalData(
                 reqId=request_id,
                 contract=contract,
                 endDateTime="",
                 durationStr=duration,
                 barSizeSetting=bar_size,
-                whatToShow="MIDPOINT",
+                whatToShow=what_to_show,
                 useRTH=1,
                 formatDate=1,
-                keepUpToDate=False,
+                keepUpToDate=keep_up_to_date,
                 chartOptions=[],
         )
-        time.sleep(5)
-        bar_sizes = ["day", "D", "week", "W", "month"]
-        if any(x in bar_size for x in bar_sizes):
-            fmt = "%Y%m%d"
-        else:
-            fmt = "%Y%m%d %H:%M:%S %Z"
-
-        data = self.historical_data[request_id]
+        return future
+
+    def _historical_frame(self, request_id, data, contract, bar_size):
         df = pd.DataFrame(data, columns=TRADE_BAR_PROPERTIES)
-        df.set_index(pd.to_datetime(df.time, format=fmt), inplace=True)
+        df.set_index(parse_bar_times(df.time, bar_size), inplace=True)
         df.drop("time", axis=1, inplace=True)
         df["symbol"] = contract.symbol
         df.request_id = request_id
         return df
 
-    def get_historical_data_for_many(self, request_id, contracts, duration, bar_size, col_to_use="close"):
-        dfs = []
+    # queue a historical request behind the pacing scheduler, asking only for the
+    # bars the cache is missing. Returns the future and the duration actually requested;
+    # the timeout runs from when the scheduler sends the request, not while it waits on pacing.
+    def _submit_historical_data(self, request_id, contract, duration, bar_size,
+                                what_to_show="MIDPOINT", timeout=None):
+        key = contract_key(contract)
+        fetch = duration
+        if self.bar_cache is not None:
+            fetch = self.bar_cache.plan(
+                    BarCache.key(key, bar_size, what_to_show), duration, bar_size)
+            if fetch is None:
+                future = Future()
+                future.set_result(None)
+                return future, fetch
+        future = self.historical_scheduler.submit(
+                request_id,
+                key,
+                (key, fetch, bar_size, what_to_show),
+                contract,
+                fetch,
+                bar_size,
+                what_to_show,
+                **request_pacing(bar_size, what_to_show),
+                timeout=timeout,
+        )
+        return future, fetch
+
+    def _collect_historical_data(self, request_id, contract, duration, bar_size,
+                                 what_to_show, fetch, data):
+        if self.bar_cache is not None:
+            data = self.bar_cache.merge(
+                    BarCache.key(contract_key(contract), bar_size, what_to_show),
+                    data,
+                    duration,
+                    full=fetch == duration,
+            )
+        return self._historical_frame(request_id, data, contract, bar_size)
+
+    # cancel a sent request with TWS and fail its future, so the scheduler frees the open
+    # request slot it holds; the scheduler calls this once a request outlives its timeout
+    def _expire_historical_data(self, request_id, reason="timed out"):
+        self.cancelHistoricalData(request_id)
+        self.historical_data.pop(request_id, None)
+        self.live_bars.pop(request_id, None)
+        self._fail_request(
+                request_id, FutureTimeoutError(f"historical request {request_id} {reason}"))
+
+    # a request still queued is dropped, one already sent is expired
+    def _cancel_historical_data(self, request_id, future):
+        if not future.cancel():
+            self._expire_historical_data(request_id, "cancelled")
+
+    def get_historical_data(self, request_id, contract, duration, bar_size,
+                            what_to_show="MIDPOINT", timeout=HISTORICAL_DATA_TIMEOUT):
+        if request_id is None:
+            request_id = self.next_request_id()
+        future, fetch = self._submit_historical_data(
+                request_id, contract, duration, bar_size, what_to_show, timeout)
+        data = future.result()
+        return self._collect_historical_data(
+                request_id, contract, duration, bar_size, what_to_show, fetch, data)
+
+    # sends every request at once (within pacing limits) and pivots each result in as it arrives
+    def get_historical_data_for_many(self, contracts, duration, bar_size, col_to_use="close",
+                                     what_to_show="MIDPOINT", timeout=HISTORICAL_DATA_TIMEOUT):
+        futures = {}
         for contract in contracts:
-            data = self.get_historical_data(
-                    request_id, contract, duration, bar_size)
-            dfs.append(data)
-            request_id += 1
-        return (
-                pd.concat(dfs)
-                .reset_index()
-                .pivot(
-                    index="time",
-                    columns="symbol",
-                    values=col_to_use
+            request_id = self.next_request_id()
+            future, fetch = self._submit_historical_data(
+                    request_id, contract, duration, bar_size, what_to_show, timeout)
+            futures[future] = (request_id, contract, fetch)
+
+        columns = {}
+        try:
+            for future in as_completed(futures):
+                request_id, contract, fetch = futures[future]
+                df = self._collect_historical_data(
+                        request_id,
+                        contract,
+                        duration,
+                        bar_size,
+                        what_to_show,
+                        fetch,
+                        future.result(),
                 )
-        )
-    
-    def get_market_data(self, request_id, contract, tick_type=4):
+                columns[contract.symbol] = df[col_to_use]
+        except BaseException:
+            for future, (request_id, contract, fetch) in futures.items():
+                if not future.done():
+                    self._cancel_historical_data(request_id, future)
+            raise
+        data = pd.DataFrame(columns)
+        data.index.name = "time"
+        data.columns.name = "symbol"
+        return data.sort_index(axis=1)
+
+    # keepUpToDate requests for a set of contracts feeding one live wide frame
+    def get_live_bars(self, contracts, duration, bar_size, col_to_use="close",
+                      what_to_show="MIDPOINT", timeout=HISTORICAL_DATA_TIMEOUT):
+        live = LiveBars([contract.symbol for contract in contracts], col_to_use)
+        futures = []
+        for contract in contracts:
+            request_id = self.next_request_id()
+            live.request_ids[request_id] = contract.symbol
+            self.live_bars[request_id] = (live, contract.symbol, bar_size)
+            key = contract_key(contract)
+            futures.append(self.historical_scheduler.submit(
+                    request_id,
+                    key,
+                    (key, duration, bar_size, what_to_show, True),
+                    contract,
+                    duration,
+                    bar_size,
+                    what_to_show,
+                    True,
+                    **request_pacing(bar_size, what_to_show),
+                    timeout=timeout,
+            ))
+        try:
+            for future in as_completed(futures):
+                future.result()
+        except BaseException:
+            # requests still waiting on pacing are dropped before they go out
+            for future in futures:
+                future.cancel()
+            self.cancel_live_bars(live)
+            raise
+        return live
+
+    def cancel_live_bars(self, live):
+        for request_id in live.request_ids:
+            if request_id in self.live_bars:
+                self._expire_historical_data(request_id, "cancelled")
+
+    # long-lived subscription, one per contract, feeding the market data cache
+    def subscribe_market_data(self, contract):
+        request_id = self.next_request_id()
+        if not self.market_data.add(request_id, contract_key(contract)):
+            return
         self.reqMktData(
                 reqId=request_id,
                 contract=contract,
                 genericTickList="",
-                snapshot=True,
+                snapshot=False,
                 regulatorySnapshot=False,
                 mktDataOptions=[]
         )
-        time.sleep(5)
-        self.cancelMktData(reqId=request_id)
-        return self.market_data[request_id].get(tick_type)
-
-    def tickPrice(self, request_id, tick_type, price, attrib):
-        if request_id not in self.market_data.keys():
-            self.market_data[request_id] = {}
-            self.market_data[request_id][tick_type] = float(price)
-    
-    def get_streaming_data(self, request_id, contract):
+
+    def unsubscribe_market_data(self, contract):
+        request_id = self.market_data.remove(contract_key(contract))
+        if request_id is not None:
+            self.cancelMktData(reqId=request_id)
+
+    # max_age bounds how old the cached tick may be, None trusts the live subscription
+    def get_market_data(self, contract, tick_type=4, max_age=None, timeout=MARKET_DATA_TIMEOUT):
+        self.subscribe_market_data(contract)
+        key = contract_key(contract)
+        try:
+            return self.market_data.get(key, tick_type, max_age=max_age, timeout=timeout)
+        except IBError:
+            # TWS has dropped the subscription, the next lookup subscribes again
+            self.market_data.remove(key)
+            raise
+
+    def get_streaming_batches(self, request_id, contract, max_items=None, timeout=None):
+        buffer = TickRingBuffer()
+        self.tick_buffers[request_id] = buffer
         self.reqTickByTickData(
                 reqId=request_id,
                 contract=contract,
@@ -171,57 +379,139 @@ class IBClient(EClient):
                 numberOfTicks=0,
                 ignoreSize=True
         )
-        time.sleep(10)
+        # with a timeout, empty batches are yielded so the consumer can do periodic work
         while True:
-            if self.stream_event.is_set():
-                yield Tick(
-                        *self.streaming_data[request_id])
-                self.stream_event.clear()
+            batch = buffer.drain(max_items=max_items, timeout=timeout)
+            if not len(batch) and buffer.closed:
+                return
+            if len(batch) or timeout is not None:
+                yield batch
+
+    def get_streaming_data(self, request_id, contract):
+        for batch in self.get_streaming_batches(request_id, contract):
+            yield from map(Tick._make, batch.tolist())
+
+    # one merged, time-ordered stream for many contracts, see TickStream.batches
+    def subscribe_ticks(self, contracts, capacity=TICK_BUFFER_CAPACITY):
+        stream = TickStream(self, capacity)
+        for contract in contracts:
+            stream.add(contract)
+        return stream
+
     def stop_streaming_data(self, request_id):
         self.cancelTickByTickData(reqId=request_id)
+        buffer = self.tick_buffers.pop(request_id, None)
+        if buffer is not None:
+            buffer.close()
 
-    def get_account_values(self, key=None):
+    # account and portfolio updates are subscribed once, the getters read the live state
+    def start_account_updates(self):
+        if self._account_updates_started:
+            return
+        self._account_updates_started = True
         self.reqAccountUpdates(True, self.account)
-        time.sleep(2)
+
+    def start_pnl_updates(self, request_id=ACCOUNT_PNL_ID):
+        if request_id in self._pnl_request_ids:
+            return
+        self._pnl_request_ids.add(request_id)
+        self.reqPnL(request_id, self.account, "")
+
+    def get_account_values(self, key=None, timeout=ACCOUNT_TIMEOUT):
+        self.start_account_updates()
+        self.account_state.wait("account_values", timeout)
         if key:
             return self.account_values[key]
         return self.account_values
 
-    def get_positions(self):
-        self.reqAccountUpdates(True, self.account)
-        time.sleep(2)
+    def get_positions(self, timeout=ACCOUNT_TIMEOUT):
+        self.start_account_updates()
+        self.account_state.wait("positions", timeout)
         return self.positions
 
-    def get_pnl(self, request_id):
-        self.reqPnL(request_id, self.account, "")
-        time.sleep(2)
+    def get_pnl(self, request_id=ACCOUNT_PNL_ID, timeout=ACCOUNT_TIMEOUT):
+        self.start_pnl_updates(request_id)
+        self.account_state.wait(("pnl", request_id), timeout)
         return self.account_pnl
 
+    # when each section of the account state last changed, as a unix timestamp
+    def account_updated_at(self, section):
+        return self.account_state.updated_at[section]
+
     def get_streaming_pnl(self, request_id, interval=60, pnl_type="unrealized_pnl"):
-        interval = max(interval, 5) - 2
         while True:
             pnl = self.get_pnl(request_id=request_id)
             yield{"date": pd.Timestamp.now(),
                   "pnl": pnl[request_id].get(pnl_type)}
             time.sleep(interval)
     
-    def get_streaming_returns(self, request_id, interval, pnl_type):
-        returns = pd.Series
+    # returns between consecutive PnL snapshots, kept in a fixed-size buffer and fed to the
+    # risk engine one at a time
+    def get_streaming_returns(self, request_id, interval, pnl_type, capacity=TIMESERIES_CAPACITY):
+        returns = TimeSeriesBuffer(capacity)
+        self.portfolio_returns = returns
+        previous = None
         for snapshot in self.get_streaming_pnl(
             request_id=request_id,
             interval=interval,
             pnl_type=pnl_type
         ):
-            returns.loc[snapshot["date"]] = snapshot["pnl"]
-            if len(returns) > 1:
-                self.portfolio_returns = (
-                    returns
-                    .pct_change()
-                    .dropna()
-                )
+            pnl = snapshot["pnl"]
+            if pnl is None:
+                continue
+            if previous:
+                value = pnl / previous - 1
+                returns.append(snapshot["date"], value)
+                self.risk.update(value)
+            previous = pnl
     
-    def resolve_contract(self, contract, request_id=DEFAULT_MARKET_DATA_ID):
+    # contract details, completed by the wrapper on contractDetailsEnd
+    def _request_contract_details(self, request_id, contract):
+        self.contract_details[request_id] = []
+        future = self._register_request(request_id)
         self.reqContractDetails(reqId=request_id, contract=contract)
-        time.sleep(2)
-        self.contractDetailsEnd(reqId=request_id)
-        return self.resolved_contract
\ No newline at end of file
+        return future
+
+    def _submit_contract_details(self, contract, request_id=None):
+        if self.contract_cache is not None:
+            details = self.contract_cache.get(contract_key(contract), contract.conId)
+            if details is not None:
+                future = Future()
+                future.set_result([details])
+                return future, None
+        if request_id is None:
+            request_id = self.next_request_id()
+        return self._request_contract_details(request_id, contract), request_id
+
+    def _collect_contract_details(self, contract, details):
+        if not details:
+            raise LookupError(f"no contract details for {contract_key(contract)}")
+        if self.contract_cache is not None:
+            self.contract_cache.put(contract_key(contract), details[0])
+        return details[0]
+
+    def resolve_contract(self, contract, request_id=None, timeout=CONTRACT_DETAILS_TIMEOUT):
+        future, request_id = self._submit_contract_details(contract, request_id)
+        try:
+            details = future.result(timeout=timeout)
+        except FutureTimeoutError:
+            self.request_futures.pop(request_id, None)
+            raise
+        return self._collect_contract_details(contract, details)
+
+    # all requests go out at once, the result keeps the order of the contracts
+    def resolve_contracts(self, contracts, timeout=CONTRACT_DETAILS_TIMEOUT):
+        futures = {}
+        for i, contract in enumerate(contracts):
+            future, request_id = self._submit_contract_details(contract)
+            futures[future] = (i, request_id)
+        resolved = [None] * len(futures)
+        try:
+            for future in as_completed(futures, timeout=timeout):
+                i, request_id = futures[future]
+                resolved[i] = self._collect_contract_details(contracts[i], future.result())
+        except FutureTimeoutError:
+            for future, (i, request_id) in futures.items():
+                self.request_futures.pop(request_id, None)
+            raise
+        return resolved
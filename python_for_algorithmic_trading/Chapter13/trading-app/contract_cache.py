@@ -0,0 +1,76 @@
+import pickle
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta
+
+CONTRACT_CACHE_PATH = "contract_cache.sqlite"
+# details of contracts that never expire (stocks) are refreshed after this long
+CONTRACT_CACHE_MAX_AGE = 7 * 24 * 3600
+
+CREATE_CONTRACT_DETAILS = """
+    CREATE TABLE IF NOT EXISTS contract_details
+    (
+        key STRING PRIMARY KEY,
+        con_id INTEGER,
+        expires_at REAL,
+        details BLOB
+    )"""
+
+CREATE_CONTRACT_DETAILS_CON_ID = """
+    CREATE INDEX IF NOT EXISTS contract_details_con_id ON contract_details (con_id)"""
+
+
+# the day after expiry; contract months (YYYYMM) expire at the end of the month
+def expiry_timestamp(last_trade_date):
+    value = (last_trade_date or "").strip()[:8]
+    if len(value) == 8 and value.isdigit():
+        return (datetime.strptime(value, "%Y%m%d") + timedelta(days=1)).timestamp()
+    if len(value) == 6 and value.isdigit():
+        year, month = int(value[:4]), int(value[4:])
+        return datetime(year + month // 12, month % 12 + 1, 1).timestamp()
+    return None
+
+
+# ContractDetails persisted to disk, looked up by the spec they were requested with or by
+# conId. Entries are dropped once the contract has expired or after max_age.
+class ContractCache:
+    def __init__(self, path=CONTRACT_CACHE_PATH, max_age=CONTRACT_CACHE_MAX_AGE):
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        with self._connection:
+            self._connection.execute(CREATE_CONTRACT_DETAILS)
+            self._connection.execute(CREATE_CONTRACT_DETAILS_CON_ID)
+            self._connection.execute(
+                    "DELETE FROM contract_details WHERE expires_at < ?", (time.time(),))
+
+    def get(self, key, con_id=0):
+        with self._lock:
+            row = self._connection.execute(
+                    "SELECT details, expires_at FROM contract_details "
+                    "WHERE key = ? OR (con_id = ? AND con_id != 0)",
+                    (key, con_id)
+            ).fetchone()
+        if row is None or row[1] < time.time():
+            self.misses += 1
+            return None
+        self.hits += 1
+        return pickle.loads(row[0])
+
+    def put(self, key, details):
+        expires_at = time.time() + self.max_age
+        expiry = expiry_timestamp(details.contract.lastTradeDateOrContractMonth)
+        if expiry is not None:
+            expires_at = min(expires_at, expiry)
+        with self._lock, self._connection:
+            self._connection.execute(
+                    "INSERT OR REPLACE INTO contract_details VALUES (?, ?, ?, ?)",
+                    (key, details.contract.conId, expires_at, pickle.dumps(details))
+            )
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
@@ -0,0 +1,235 @@
+import heapq
+import itertools
+import threading
+import time
+from datetime import datetime, timedelta
+from ibapi.common import BarData
+from ibapi.contract import ContractDetails
+from ibapi.execution import Execution
+from ibapi.order_state import OrderState
+
+# In-process stand-in for TWS/Gateway. Mix it in ahead of the app classes and every
+# request goes to a scripted replay instead of a socket:
+#
+#     class FakeIBApp(FakeTWS, IBApp):
+#         pass
+#
+#     app = FakeIBApp("fake", 0, 1, "DU0000000", cvar_threshold=-500)
+#
+# Callbacks are delivered one at a time from the thread running `run`, the same way the
+# EReader thread delivers them from a live connection, after `latency` seconds.
+FAKE_ACCOUNT = "DU0000000"
+
+
+class FakeTWS:
+    def configure(
+            self,
+            latency=0.0,
+            bars=390,
+            tick_rate=None,
+            ticks_per_subscription=None,
+            tick_batch=1000,
+            fill_delay=0.0,
+            price=100.0,
+            net_liquidation=1_000_000.0,
+            positions=None,
+            pnl_interval=1.0,
+    ):
+        self.fake_latency = latency
+        self.fake_bars = bars
+        self.fake_tick_rate = tick_rate
+        self.fake_ticks_per_subscription = ticks_per_subscription
+        self.fake_tick_batch = tick_batch
+        self.fake_fill_delay = fill_delay
+        self.fake_price = price
+        self.fake_net_liquidation = net_liquidation
+        self.fake_positions = positions or {}
+        self.fake_pnl_interval = pnl_interval
+
+    # --- transport ---
+    def connect(self, host, port, client_id):
+        if not hasattr(self, "fake_latency"):
+            self.configure()
+        self._fake_events = []
+        self._fake_sequence = itertools.count()
+        self._fake_cond = threading.Condition()
+        self._fake_active = set()
+        self._fake_connected = True
+        self._fake_con_ids = itertools.count(1)
+        self._fake_exec_ids = itertools.count(1)
+        self._schedule(0, self.nextValidId, 1)
+        self._schedule(0, self.managedAccounts, FAKE_ACCOUNT)
+
+    def isConnected(self):
+        return getattr(self, "_fake_connected", False)
+
+    def disconnect(self):
+        self._fake_connected = False
+        with self._fake_cond:
+            self._fake_cond.notify_all()
+        super().disconnect()
+
+    def _schedule(self, delay, callback, *args):
+        with self._fake_cond:
+            heapq.heappush(
+                    self._fake_events,
+                    (time.monotonic() + delay, next(self._fake_sequence), callback, args))
+            self._fake_cond.notify()
+
+    def run(self):
+        while self.isConnected():
+            with self._fake_cond:
+                while self._fake_connected:
+                    if self._fake_events:
+                        wait = self._fake_events[0][0] - time.monotonic()
+                        if wait <= 0:
+                            break
+                    else:
+                        wait = None
+                    self._fake_cond.wait(wait)
+                if not self._fake_connected:
+                    return
+                _, _, callback, args = heapq.heappop(self._fake_events)
+            start = time.perf_counter()
+            callback(*args)
+            self.loop_stats.record(time.perf_counter() - start, callback.__name__)
+
+    # --- historical data ---
+    def reqHistoricalData(self, reqId, contract, endDateTime, durationStr, barSizeSetting,
+                          whatToShow, useRTH, formatDate, keepUpToDate, chartOptions):
+        self._schedule(self.fake_latency, self._fake_bars, reqId, barSizeSetting)
+
+    def cancelHistoricalData(self, reqId):
+        pass
+
+    def _fake_bars(self, request_id, bar_size):
+        daily = any(x in bar_size for x in ["day", "week", "month"])
+        end = datetime.now().replace(second=0, microsecond=0)
+        step = timedelta(days=1) if daily else timedelta(minutes=1)
+        for i in range(self.fake_bars):
+            bar = BarData()
+            bar_time = end - step * (self.fake_bars - 1 - i)
+            if daily:
+                bar.date = bar_time.strftime("%Y%m%d")
+            else:
+                bar.date = bar_time.strftime("%Y%m%d %H:%M:%S") + " US/Eastern"
+            bar.open = bar.high = bar.low = bar.close = self.fake_price + i * 0.01
+            bar.volume = 100
+            self.historicalData(request_id, bar)
+        self.historicalDataEnd(request_id, "", "")
+
+    # --- market data ---
+    def reqMktData(self, reqId, contract, genericTickList, snapshot, regulatorySnapshot,
+                   mktDataOptions):
+        self._schedule(self.fake_latency, self._fake_top_of_book, reqId)
+
+    def cancelMktData(self, reqId):
+        pass
+
+    def _fake_top_of_book(self, request_id):
+        self.tickPrice(request_id, 1, self.fake_price - 0.01, None)
+        self.tickPrice(request_id, 2, self.fake_price + 0.01, None)
+        self.tickPrice(request_id, 4, self.fake_price, None)
+        self.tickSize(request_id, 0, 100)
+        self.tickSize(request_id, 3, 100)
+
+    def reqTickByTickData(self, reqId, contract, tickType, numberOfTicks, ignoreSize):
+        self._fake_active.add(reqId)
+        self._schedule(self.fake_latency, self._fake_ticks, reqId, 0)
+
+    def cancelTickByTickData(self, reqId):
+        self._fake_active.discard(reqId)
+
+    def _fake_ticks(self, request_id, sent):
+        if request_id not in self._fake_active:
+            return
+        count = self.fake_tick_batch
+        if self.fake_ticks_per_subscription is not None:
+            count = min(count, self.fake_ticks_per_subscription - sent)
+        now = int(time.time())
+        for i in range(count):
+            spread = 0.01 * (1 + (sent + i) % 3)
+            self.tickByTickBidAsk(
+                    request_id, now, self.fake_price - spread, self.fake_price + spread,
+                    100, 200, None)
+        sent += count
+        if self.fake_ticks_per_subscription is not None and sent >= self.fake_ticks_per_subscription:
+            return
+        delay = 0 if self.fake_tick_rate is None else count / self.fake_tick_rate
+        self._schedule(delay, self._fake_ticks, request_id, sent)
+
+    # --- account ---
+    def reqAccountUpdates(self, subscribe, acctCode):
+        self._schedule(self.fake_latency, self._fake_account, acctCode)
+
+    def _fake_account(self, account):
+        self.updateAccountValue(
+                "NetLiquidation", str(self.fake_net_liquidation), "USD", account)
+        self.updateAccountValue("TotalCashValue", str(self.fake_net_liquidation), "USD", account)
+        for contract, position in self.fake_positions.items():
+            self.updatePortfolio(
+                    contract, position, self.fake_price, position * self.fake_price,
+                    self.fake_price, 0.0, 0.0, account)
+        self.accountDownloadEnd(account)
+
+    def reqPnL(self, reqId, account, modelCode):
+        self._schedule(self.fake_latency, self._fake_pnl, reqId, 0)
+
+    def cancelPnL(self, reqId):
+        pass
+
+    def _fake_pnl(self, request_id, step):
+        unrealized = 1000.0 + 50.0 * ((step * 7919) % 41 - 20)
+        self.pnl(request_id, unrealized, unrealized, 0.0)
+        self._schedule(self.fake_pnl_interval, self._fake_pnl, request_id, step + 1)
+
+    # --- contracts ---
+    def reqContractDetails(self, reqId, contract):
+        self._schedule(self.fake_latency, self._fake_contract_details, reqId, contract)
+
+    def _fake_contract_details(self, request_id, contract):
+        details = ContractDetails()
+        details.contract.symbol = contract.symbol
+        details.contract.secType = contract.secType
+        details.contract.exchange = contract.exchange
+        details.contract.currency = contract.currency
+        details.contract.lastTradeDateOrContractMonth = contract.lastTradeDateOrContractMonth
+        details.contract.strike = contract.strike
+        details.contract.right = contract.right
+        details.contract.conId = next(self._fake_con_ids)
+        self.contractDetails(request_id, details)
+        self.contractDetailsEnd(request_id)
+
+    # --- orders ---
+    def reqIds(self, numIds):
+        pass
+
+    def reqGlobalCancel(self):
+        pass
+
+    def cancelOrder(self, orderId, manualCancelOrderTime=""):
+        pass
+
+    def placeOrder(self, orderId, contract, order):
+        self._schedule(self.fake_latency, self._fake_submitted, orderId, contract, order)
+        self._schedule(
+                self.fake_latency + self.fake_fill_delay, self._fake_filled, orderId, contract, order)
+
+    def _fake_submitted(self, order_id, contract, order):
+        order_state = OrderState()
+        order_state.status = "Submitted"
+        self.openOrder(order_id, contract, order, order_state)
+        self.orderStatus(
+                order_id, "Submitted", 0, order.totalQuantity, 0.0, 0, 0, 0.0, 0, "", 0.0)
+
+    def _fake_filled(self, order_id, contract, order):
+        execution = Execution()
+        execution.execId = str(next(self._fake_exec_ids))
+        execution.orderId = order_id
+        execution.shares = order.totalQuantity
+        execution.price = self.fake_price
+        execution.lastLiquidity = 1
+        self.execDetails(-1, contract, execution)
+        self.orderStatus(
+                order_id, "Filled", order.totalQuantity, 0, self.fake_price, 0, 0,
+                self.fake_price, 0, "", 0.0)
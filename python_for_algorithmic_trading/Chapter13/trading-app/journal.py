@@ -0,0 +1,38 @@
+from batch_worker import BatchWorker
+from utils import STRATEGY_DATABASE
+
+JOURNAL_BATCH_SIZE = 500
+JOURNAL_FLUSH_INTERVAL = 0.2
+
+
+# Order and execution events persisted from a background thread so the callbacks that
+# report them never wait on the disk. Events are committed in batches on a connection
+# running with synchronous=FULL; a batch whose commit fails is kept and retried. flush()
+# returns True only when everything recorded before it is durable, see BatchWorker.
+class OrderJournal(BatchWorker):
+    retry = True
+
+    def __init__(
+            self,
+            path=STRATEGY_DATABASE,
+            batch_size=JOURNAL_BATCH_SIZE,
+            flush_interval=JOURNAL_FLUSH_INTERVAL
+    ):
+        super().__init__(path, batch_size, flush_interval, pragmas=("PRAGMA synchronous=FULL",))
+
+    def record(self, query, values):
+        self._put((query, values))
+
+    @property
+    def events_written(self):
+        return self.items_written
+
+    def _commit(self, connection, events):
+        # consecutive events for the same statement go through one executemany
+        with connection:
+            start = 0
+            for end in range(1, len(events) + 1):
+                if end == len(events) or events[end][0] != events[start][0]:
+                    connection.executemany(
+                            events[start][0], [values for _, values in events[start:end]])
+                    start = end
@@ -0,0 +1,107 @@
+import threading
+import numpy as np
+import pandas as pd
+
+LIVE_BARS_CAPACITY = 20_000
+
+
+# Wide frame of one bar column (close by default) per contract, kept current from
+# keepUpToDate historical requests. Rows live in preallocated arrays: an update for the
+# current bar overwrites it in place, a newer bar appends a row. When a contract's bar
+# moves on, the previous one has closed and subscribers are called with (symbol, time).
+class LiveBars:
+    def __init__(self, symbols, col_to_use="close", capacity=LIVE_BARS_CAPACITY):
+        self.symbols = list(symbols)
+        self.col_to_use = col_to_use
+        self.capacity = capacity
+        self.request_ids = {}
+        self.tz = None
+        self._columns = {symbol: i for i, symbol in enumerate(self.symbols)}
+        self._times = np.empty(capacity, dtype="datetime64[ns]")
+        self._values = np.full((capacity, len(self.symbols)), np.nan)
+        self._rows = {}
+        self._length = 0
+        self._last_bar = {}
+        self._subscribers = []
+        self._lock = threading.Lock()
+
+    def subscribe(self, callback):
+        self._subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        self._subscribers.remove(callback)
+
+    def _row(self, bar_time):
+        row = self._rows.get(bar_time)
+        if row is not None:
+            return row
+        if self._length == self.capacity:
+            self._drop_oldest(self.capacity // 2)
+        row = self._length
+        # bars normally arrive in order, keep rows sorted when one does not
+        if row and bar_time < self._times[row - 1]:
+            row = int(np.searchsorted(self._times[:self._length], bar_time))
+            self._times[row + 1:self._length + 1] = self._times[row:self._length]
+            self._values[row + 1:self._length + 1] = self._values[row:self._length]
+            self._values[row] = np.nan
+            self._rows = {t: i + (i >= row) for t, i in self._rows.items()}
+        self._times[row] = bar_time
+        self._rows[bar_time] = row
+        self._length += 1
+        return row
+
+    def _drop_oldest(self, count):
+        keep = self._length - count
+        self._times[:keep] = self._times[count:self._length]
+        self._values[:keep] = self._values[count:self._length]
+        self._values[keep:] = np.nan
+        self._length = keep
+        self._rows = {t: i - count for t, i in self._rows.items() if i >= count}
+
+    # rows are kept in naive UTC, the frame is shown in the time zone the bars came in
+    def _utc(self, times):
+        if times.tz is not None:
+            self.tz = times.tz
+            times = times.tz_convert("UTC").tz_localize(None)
+        return times
+
+    # seed a contract from the bars of the initial historical request
+    def load(self, symbol, times, values):
+        column = self._columns[symbol]
+        times = self._utc(times).to_numpy()
+        with self._lock:
+            for bar_time, value in zip(times, values):
+                self._values[self._row(bar_time), column] = float(value)
+            if len(times):
+                self._last_bar[symbol] = times[-1]
+
+    def update(self, symbol, bar_time, value):
+        column = self._columns[symbol]
+        bar_time = self._utc(bar_time).to_datetime64()
+        with self._lock:
+            previous = self._last_bar.get(symbol)
+            self._values[self._row(bar_time), column] = float(value)
+            closed = previous is not None and bar_time > previous
+            if previous is None or closed:
+                self._last_bar[symbol] = bar_time
+        if closed:
+            closed_time = pd.Timestamp(previous)
+            if self.tz is not None:
+                closed_time = closed_time.tz_localize("UTC").tz_convert(self.tz)
+            for callback in list(self._subscribers):
+                callback(symbol, closed_time)
+
+    # the frame is a view on the buffer, copy it before holding on to it across updates
+    @property
+    def frame(self):
+        with self._lock:
+            index = pd.DatetimeIndex(self._times[:self._length], name="time")
+            if self.tz is not None:
+                index = index.tz_localize("UTC").tz_convert(self.tz)
+            frame = pd.DataFrame(
+                    self._values[:self._length],
+                    index=index,
+                    columns=pd.Index(self.symbols, name="symbol"),
+                    copy=False,
+            )
+        return frame
@@ -0,0 +1,58 @@
+import time
+import numpy as np
+
+LOOP_STATS_SAMPLES = 1 << 14
+
+
+# How long each message keeps the message loop busy. Every message delivered from TWS is
+# decoded and handed to its callback on the loop thread, nothing else is read from the
+# socket until the callback returns. Durations are kept per message and the most recent
+# ones in a ring for percentiles.
+class LoopStats:
+    def __init__(self, samples=LOOP_STATS_SAMPLES):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.by_message = {}
+        self._samples = np.zeros(samples)
+
+    def record(self, seconds, message=None):
+        self._samples[self.count % len(self._samples)] = seconds
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+        stats = self.by_message.get(message)
+        if stats is None:
+            stats = self.by_message[message] = [0, 0.0, 0.0]
+        stats[0] += 1
+        stats[1] += seconds
+        if seconds > stats[2]:
+            stats[2] = seconds
+
+    # wrap EClient.decoder.interpret, the message id is the first field
+    def timed(self, interpret):
+        def timed_interpret(fields):
+            start = time.perf_counter()
+            try:
+                return interpret(fields)
+            finally:
+                self.record(time.perf_counter() - start, int(fields[0]) if fields else None)
+        return timed_interpret
+
+    def snapshot(self, slowest=5):
+        samples = self._samples[:min(self.count, len(self._samples))] * 1e6
+        if not len(samples):
+            return {"count": 0}
+        messages = sorted(self.by_message.items(), key=lambda item: item[1][1], reverse=True)
+        return {
+            "count": self.count,
+            "mean_us": self.total / self.count * 1e6,
+            "p50_us": float(np.percentile(samples, 50)),
+            "p99_us": float(np.percentile(samples, 99)),
+            "max_us": self.max * 1e6,
+            "slowest": {
+                message: {"count": count, "total_ms": total * 1e3, "max_us": longest * 1e6}
+                for message, (count, total, longest) in messages[:slowest]
+            },
+        }
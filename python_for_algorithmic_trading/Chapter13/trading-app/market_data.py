@@ -0,0 +1,97 @@
+import threading
+import time
+
+MARKET_DATA_TIMEOUT = 10
+
+
+# Top of book per contract, fed by long-lived reqMktData subscriptions. Every price and
+# size tick type is kept with the time it arrived; `get` returns straight from memory
+# and only blocks until the first tick (or a fresh one, when max_age is given) arrives.
+# Listeners are called from the EReader thread with (key, tick_type) after every update,
+# and with (key, None) when a subscription fails.
+class MarketDataCache:
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._ticks = {}
+        self._request_ids = {}
+        self._keys = {}
+        self._errors = {}
+        self.listeners = []
+
+    def request_id(self, key):
+        return self._request_ids.get(key)
+
+    # False when the contract already has a subscription
+    def add(self, request_id, key):
+        with self._cond:
+            if key in self._request_ids:
+                return False
+            self._request_ids[key] = request_id
+            self._keys[request_id] = key
+            self._ticks.setdefault(key, {})
+            self._errors.pop(key, None)
+        return True
+
+    def remove(self, key):
+        with self._cond:
+            request_id = self._request_ids.pop(key, None)
+            self._keys.pop(request_id, None)
+            self._ticks.pop(key, None)
+            self._errors.pop(key, None)
+        return request_id
+
+    def update(self, request_id, tick_type, value):
+        with self._cond:
+            key = self._keys.get(request_id)
+            ticks = self._ticks.get(key)
+            if ticks is None:
+                return
+            ticks[tick_type] = (value, time.monotonic())
+            self._cond.notify_all()
+        for listener in self.listeners:
+            listener(key, tick_type)
+
+    def fail(self, request_id, exception):
+        key = self._keys.get(request_id)
+        if key is None:
+            return
+        with self._cond:
+            self._errors[key] = exception
+            self._cond.notify_all()
+        for listener in self.listeners:
+            listener(key, None)
+
+    def _fresh(self, key, tick_type, max_age):
+        tick = self._ticks.get(key, {}).get(tick_type)
+        if tick is None:
+            return None
+        if max_age is not None and time.monotonic() - tick[1] > max_age:
+            return None
+        return tick
+
+    def get(self, key, tick_type, max_age=None, timeout=MARKET_DATA_TIMEOUT):
+        tick = self._fresh(key, tick_type, max_age)
+        if tick is not None:
+            return tick[0]
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while True:
+                if key in self._errors:
+                    raise self._errors[key]
+                tick = self._fresh(key, tick_type, max_age)
+                if tick is not None:
+                    return tick[0]
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError(
+                            f"no tick type {tick_type} for {key} within {timeout} seconds")
+                self._cond.wait(remaining)
+
+    # every tick type seen for a contract with its age in seconds
+    def snapshot(self, key):
+        now = time.monotonic()
+        with self._cond:
+            return {
+                tick_type: (value, now - received)
+                for tick_type, (value, received) in self._ticks.get(key, {}).items()
+            }
@@ -0,0 +1,32 @@
+import threading
+
+ORDER_ID_TIMEOUT = 10
+
+# Thread-safe local order id sequence. TWS hands out the first valid id once through
+# nextValidId; after that ids are allocated here without a round trip, and every id
+# remembers the contract and order it was used for.
+class OrderIdSequence:
+    def __init__(self):
+        self._next = None
+        self._lock = threading.Lock()
+        self._seeded = threading.Event()
+        self.orders = {}
+
+    # nextValidId arrives again after reconnects and reqIds, never move backwards
+    def seed(self, order_id):
+        with self._lock:
+            if self._next is None or order_id > self._next:
+                self._next = order_id
+        self._seeded.set()
+
+    def allocate(self, contract=None, order=None, timeout=ORDER_ID_TIMEOUT):
+        if not self._seeded.wait(timeout):
+            raise TimeoutError("no nextValidId from TWS yet")
+        with self._lock:
+            order_id = self._next
+            self._next += 1
+            self.orders[order_id] = (contract, order)
+        return order_id
+
+    def lookup(self, order_id):
+        return self.orders.get(order_id)
@@ -0,0 +1,194 @@
+import heapq
+import threading
+import time
+from collections import deque
+from itertools import count
+from concurrent.futures import Future
+from bar_cache import bar_size_seconds
+
+# IB historical data pacing limits. For bars of 30 seconds or less, with BID_ASK requests
+# counting twice:
+#   - no more than 60 requests in any 10 minute window
+#   - no identical request within 15 seconds
+#   - no 6 or more requests for the same contract within 2 seconds
+# and for every bar size:
+#   - no more than 50 simultaneous open requests
+SMALL_BAR_SECONDS = 30
+MAX_REQUESTS_PER_WINDOW = 60
+REQUEST_WINDOW = 600
+IDENTICAL_REQUEST_INTERVAL = 15
+SAME_CONTRACT_MAX_REQUESTS = 5
+SAME_CONTRACT_WINDOW = 2
+MAX_OPEN_REQUESTS = 50
+
+
+
+# the submit keywords for a request, see HistoricalScheduler
+def request_pacing(bar_size, what_to_show):
+    return {
+        "paced": bar_size_seconds(bar_size) <= SMALL_BAR_SECONDS,
+        "weight": 2 if what_to_show == "BID_ASK" else 1,
+    }
+
+
+# Sends historical requests as fast as the pacing limits allow. `send(request_id, *args)`
+# must issue the request and return a future completed when the data has arrived.
+# `submit` queues a request and returns a future mirroring that one, so callers
+# never block on pacing themselves. Cancelling the returned future drops a request still queued.
+# A request submitted with a timeout that has not completed that long after it was sent is
+# handed to `expire(request_id)`, which must cancel it and fail its future.
+class HistoricalScheduler:
+    def __init__(
+            self,
+            send,
+            expire=None,
+            max_requests=MAX_REQUESTS_PER_WINDOW,
+            window=REQUEST_WINDOW,
+            identical_interval=IDENTICAL_REQUEST_INTERVAL,
+            same_contract_max=SAME_CONTRACT_MAX_REQUESTS,
+            same_contract_window=SAME_CONTRACT_WINDOW,
+            max_open=MAX_OPEN_REQUESTS,
+    ):
+        self._send = send
+        self._expire = expire
+        self.max_requests = max_requests
+        self.window = window
+        self.identical_interval = identical_interval
+        self.same_contract_max = same_contract_max
+        self.same_contract_window = same_contract_window
+        self.max_open = max_open
+
+        self._cond = threading.Condition()
+        self._queue = deque()
+        self._sent = deque()
+        self._sent_by_contract = {}
+        self._last_identical = {}
+        self._open = 0
+        self._deadlines = []
+        self._deadline_order = count()
+        self._deadlines_cond = threading.Condition()
+        threading.Thread(target=self._dispatch, daemon=True).start()
+        threading.Thread(target=self._expire_overdue, daemon=True).start()
+
+    # only paced requests count towards the request window, same contract and identical
+    # request limits, `weight` times each; the timeout runs from when the request is sent
+    def submit(self, request_id, contract_key, request_key, *args, paced=True, weight=1,
+               timeout=None):
+        future = Future()
+        with self._cond:
+            self._queue.append((
+                request_id, contract_key, request_key, args, future, paced, weight, timeout))
+            self._cond.notify()
+        return future
+
+    @property
+    def open_requests(self):
+        return self._open
+
+    @property
+    def queued_requests(self):
+        return len(self._queue)
+
+    # seconds until a request may be sent without breaking a pacing rule
+    def _delay(self, contract_key, request_key, paced, weight, now):
+        if self._open >= self.max_open:
+            return None
+        delay = 0.0
+        while self._sent and now - self._sent[0] >= self.window:
+            self._sent.popleft()
+        if not paced:
+            return delay
+        if len(self._sent) + weight > self.max_requests:
+            delay = max(delay, self._sent[len(self._sent) + weight - self.max_requests - 1]
+                        + self.window - now)
+
+        by_contract = self._sent_by_contract.get(contract_key, ())
+        recent = [t for t in by_contract if now - t < self.same_contract_window]
+        if len(recent) + weight > self.same_contract_max:
+            delay = max(delay, recent[len(recent) + weight - self.same_contract_max - 1]
+                        + self.same_contract_window - now)
+
+        last = self._last_identical.get(request_key)
+        if last is not None and now - last < self.identical_interval:
+            delay = max(delay, last + self.identical_interval - now)
+        return delay
+
+    def _next_ready(self):
+        now = time.monotonic()
+        wait = None
+        for item in [item for item in self._queue if item[4].cancelled()]:
+            self._queue.remove(item)
+        for item in self._queue:
+            delay = self._delay(item[1], item[2], item[5], item[6], now)
+            if delay is None:
+                return None, None
+            if delay <= 0:
+                self._queue.remove(item)
+                return item, None
+            wait = delay if wait is None else min(wait, delay)
+        return None, wait
+
+    def _record(self, contract_key, request_key, paced, weight):
+        now = time.monotonic()
+        self._open += 1
+        if not paced:
+            return
+        by_contract = self._sent_by_contract.setdefault(
+                contract_key, deque(maxlen=self.same_contract_max))
+        for _ in range(weight):
+            self._sent.append(now)
+            by_contract.append(now)
+        self._last_identical[request_key] = now
+        if len(self._last_identical) > 1024:
+            self._last_identical = {
+                key: t for key, t in self._last_identical.items()
+                if now - t < self.identical_interval
+            }
+
+    def _done(self, outer, inner):
+        with self._cond:
+            self._open -= 1
+            self._cond.notify()
+        if inner.exception() is not None:
+            outer.set_exception(inner.exception())
+        else:
+            outer.set_result(inner.result())
+
+    def _dispatch(self):
+        while True:
+            with self._cond:
+                item, wait = self._next_ready()
+                while item is None:
+                    self._cond.wait(timeout=wait)
+                    item, wait = self._next_ready()
+                request_id, contract_key, request_key, args, outer, paced, weight, timeout = item
+                if not outer.set_running_or_notify_cancel():
+                    continue
+                self._record(contract_key, request_key, paced, weight)
+            try:
+                inner = self._send(request_id, *args)
+            except Exception as exc:
+                inner = Future()
+                inner.set_exception(exc)
+            if timeout is not None and self._expire is not None:
+                with self._deadlines_cond:
+                    heapq.heappush(self._deadlines, (
+                        time.monotonic() + timeout, next(self._deadline_order), request_id, inner))
+                    self._deadlines_cond.notify()
+            inner.add_done_callback(
+                    lambda inner, outer=outer: self._done(outer, inner))
+
+    def _expire_overdue(self):
+        while True:
+            with self._deadlines_cond:
+                while True:
+                    while self._deadlines and self._deadlines[0][3].done():
+                        heapq.heappop(self._deadlines)
+                    now = time.monotonic()
+                    if self._deadlines and self._deadlines[0][0] <= now:
+                        _, _, request_id, inner = heapq.heappop(self._deadlines)
+                        break
+                    self._deadlines_cond.wait(
+                            self._deadlines[0][0] - now if self._deadlines else None)
+            if not inner.done():
+                self._expire(request_id)
@@ -0,0 +1,86 @@
+import threading
+import numpy as np
+from utils import TICK_DTYPE
+
+TICK_BUFFER_CAPACITY = 1 << 16
+
+
+# Fixed-capacity, array-backed tick queue for one subscription. The EReader thread appends
+# and never blocks: when the consumer falls a full buffer behind, the oldest ticks are
+# overwritten and counted in `overflows`. Consumers block in `drain`, which hands back
+# everything queued so far (up to max_items) as one structured array. Several buffers can
+# share a condition so a single consumer can wait on all of them. `on_ready`, if given, is
+# called from the producer thread whenever the buffer goes from empty to holding ticks
+# (or is closed), for consumers that wait somewhere other than the condition.
+class TickRingBuffer:
+    def __init__(self, capacity=TICK_BUFFER_CAPACITY, dtype=TICK_DTYPE, condition=None,
+                 on_ready=None):
+        self.capacity = capacity
+        self.overflows = 0
+        self._data = np.zeros(capacity, dtype=dtype)
+        self._head = 0
+        self._tail = 0
+        self._closed = False
+        self._error = None
+        self._cond = condition if condition is not None else threading.Condition()
+        self.on_ready = on_ready
+
+    def __len__(self):
+        return self._head - self._tail
+
+    @property
+    def closed(self):
+        return self._closed
+
+    @property
+    def error(self):
+        return self._error
+
+    def append(self, *values):
+        with self._cond:
+            if self._head - self._tail == self.capacity:
+                self._tail += 1
+                self.overflows += 1
+            was_empty = self._head == self._tail
+            self._data[self._head % self.capacity] = values
+            self._head += 1
+            self._cond.notify_all()
+            if was_empty and self.on_ready is not None:
+                self.on_ready()
+
+    def close(self, error=None):
+        with self._cond:
+            self._closed = True
+            self._error = error
+            self._cond.notify_all()
+            if self.on_ready is not None:
+                self.on_ready()
+
+    # non-blocking, returns whatever is queued (possibly nothing)
+    def take(self, max_items=None):
+        with self._cond:
+            return self._take(max_items)
+
+    def _take(self, max_items):
+        count = self._head - self._tail
+        if max_items is not None:
+            count = min(count, max_items)
+        start = self._tail % self.capacity
+        end = start + count
+        if end <= self.capacity:
+            batch = self._data[start:end].copy()
+        else:
+            batch = np.concatenate(
+                    (self._data[start:], self._data[:end - self.capacity]))
+        self._tail += count
+        return batch
+
+    # blocks until ticks are queued, the buffer is closed or the timeout expires; an
+    # empty batch means nothing arrived in time or the stream has ended
+    def drain(self, max_items=None, timeout=None):
+        with self._cond:
+            self._cond.wait_for(
+                    lambda: self._head > self._tail or self._closed, timeout)
+            if self._head == self._tail and self._error is not None:
+                raise self._error
+            return self._take(max_items)
@@ -0,0 +1,134 @@
+import math
+import threading
+import numpy as np
+from tail_risk import StreamingCVaR, CVAR_ALPHA
+
+
+# Risk metrics of a return stream kept up to date one return at a time: mean and variance
+# (Welford), the compounded value with its running peak and worst drawdown, the gain and
+# loss sums of the omega ratio and the tail estimate behind CVaR (see StreamingCVaR). Every
+# update and every read is O(1), however long the session has been running, except that CVaR
+# costs one partition of the returns kept while it is still computed exactly. Definitions follow
+# empyrical: value starts at 1, omega uses a zero threshold. `version` counts updates,
+# `wait` blocks until it moves past a version already seen. Derived values are read under
+# the same lock updates take, so readers on other threads never see a half-made update.
+class RiskEngine:
+    def __init__(self, alpha=CVAR_ALPHA, decay=None):
+        self.alpha = alpha
+        self.decay = decay
+        self.version = 0
+        self._cond = threading.Condition()
+        self.reset()
+
+    def reset(self):
+        with self._cond:
+            self.count = 0
+            self.mean = 0.0
+            self._m2 = 0.0
+            self.value = 1.0
+            self.peak = 1.0
+            self.max_drawdown = 0.0
+            self.gains = 0.0
+            self.losses = 0.0
+            self.last = None
+            self.tail = StreamingCVaR(self.alpha, self.decay)
+            self.version += 1
+            self._cond.notify_all()
+
+    def update(self, value):
+        if value is None or math.isnan(value):
+            return
+        with self._cond:
+            self.count += 1
+            delta = value - self.mean
+            self.mean += delta / self.count
+            self._m2 += delta * (value - self.mean)
+            self.value *= 1 + value
+            if self.value > self.peak:
+                self.peak = self.value
+            self.max_drawdown = min(self.max_drawdown, self.value / self.peak - 1)
+            if value > 0:
+                self.gains += value
+            else:
+                self.losses -= value
+            self.last = value
+            self.tail.update(value)
+            self.version += 1
+            self._cond.notify_all()
+
+    # many returns at once, with the same result as calling update for each
+    def extend(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        values = values[~np.isnan(values)]
+        if not len(values):
+            return
+        with self._cond:
+            count = len(values)
+            mean = values.mean()
+            m2 = ((values - mean) ** 2).sum()
+            total = self.count + count
+            delta = mean - self.mean
+            self._m2 += m2 + delta ** 2 * self.count * count / total
+            self.mean += delta * count / total
+            self.count = total
+            wealth = self.value * np.cumprod(1 + values)
+            peaks = np.maximum.accumulate(np.maximum(wealth, self.peak))
+            self.max_drawdown = min(self.max_drawdown, float((wealth / peaks - 1).min()))
+            self.value = float(wealth[-1])
+            self.peak = float(peaks[-1])
+            self.gains += values[values > 0].sum()
+            self.losses -= values[values < 0].sum()
+            self.last = float(values[-1])
+            for value in values.tolist():
+                self.tail.update(value)
+            self.version += 1
+            self._cond.notify_all()
+
+    # the version after the next update, or the current one if none came within timeout
+    def wait(self, version, timeout=None):
+        with self._cond:
+            self._cond.wait_for(lambda: self.version != version, timeout)
+            return self.version
+
+    @property
+    def variance(self):
+        with self._cond:
+            return self._m2 / (self.count - 1) if self.count > 1 else math.nan
+
+    @property
+    def volatility(self):
+        return math.sqrt(self.variance)
+
+    @property
+    def sharpe_ratio(self):
+        with self._cond:
+            volatility = self.volatility
+            return self.mean / volatility if volatility else math.nan
+
+    @property
+    def omega_ratio(self):
+        with self._cond:
+            if self.count < 2 or self.losses <= 0:
+                return math.nan
+            return self.gains / self.losses
+
+    # enough returns for the tail estimate to be acted on, see StreamingCVaR
+    @property
+    def ready(self):
+        with self._cond:
+            return self.tail.ready
+
+    @property
+    def var(self):
+        with self._cond:
+            return self.tail.var
+
+    @property
+    def cvar(self):
+        with self._cond:
+            return self.tail.cvar
+
+    @property
+    def drawdown(self):
+        with self._cond:
+            return self.value / self.peak - 1
@@ -0,0 +1,51 @@
+import sqlite3
+import threading
+
+SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-65536",
+)
+# compiled statements kept per connection, sqlite3 reuses them for identical SQL text
+SQLITE_CACHED_STATEMENTS = 256
+
+
+def open_connection(path, **kwargs):
+    connection = sqlite3.connect(
+            path,
+            check_same_thread=False,
+            cached_statements=SQLITE_CACHED_STATEMENTS,
+            **kwargs
+    )
+    for pragma in SQLITE_PRAGMAS:
+        connection.execute(pragma)
+    return connection
+
+
+# One autocommit connection per thread, opened on first use and reused after that.
+# close() closes every connection handed out; threads that use the pool again afterwards
+# get a fresh one.
+class ConnectionPool:
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections = []
+        self._generation = 0
+
+    def connection(self):
+        local = self._local
+        if getattr(local, "generation", None) != self._generation:
+            local.connection = open_connection(self.path, isolation_level=None)
+            local.generation = self._generation
+            with self._lock:
+                self._connections.append(local.connection)
+        return local.connection
+
+    def close(self):
+        with self._lock:
+            connections, self._connections = self._connections, []
+            self._generation += 1
+        for connection in connections:
+            connection.close()
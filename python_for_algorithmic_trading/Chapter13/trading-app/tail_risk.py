@@ -0,0 +1,166 @@
+import math
+import numpy as np
+
+CVAR_ALPHA = 0.05
+# returns CVaR is computed exactly from before the P-square estimate takes over; early on
+# its middle marker still lags the tail quantile and the tail mean picks up ordinary returns
+CVAR_EXACT_RETURNS = 10_000
+# returns needed before the estimate is worth acting on
+CVAR_MIN_RETURNS = 5
+
+
+# P-square estimate of one quantile (Jain & Chlamtac, 1985): five markers whose heights
+# are nudged towards the target positions with a parabolic fit, O(1) time and memory
+# per observation, no history kept.
+class P2Quantile:
+    def __init__(self, p):
+        self.p = p
+        self.count = 0
+        self._initial = []
+        self._heights = None
+        self._positions = [1, 2, 3, 4, 5]
+        self._desired = [1, 1 + 2 * p, 1 + 4 * p, 3 + 2 * p, 5]
+        self._increments = [0, p / 2, p, (1 + p) / 2, 1]
+
+    # exact from the first observations until there are five to place the markers
+    @property
+    def ready(self):
+        return self._heights is not None
+
+    @property
+    def value(self):
+        if self._heights is not None:
+            return self._heights[2]
+        if not self._initial:
+            return math.nan
+        ordered = sorted(self._initial)
+        return ordered[int((len(ordered) - 1) * self.p)]
+
+    # start from the order statistics of a sorted sample of at least five values instead of
+    # its first five, with every marker already where it would have converged to
+    def seed(self, ordered):
+        self.count = len(ordered)
+        self._desired = [1 + (self.count - 1) * d for d in self._increments]
+        self._positions = [int(round(d)) for d in self._desired]
+        # markers need distinct positions, small samples would round several onto one
+        for i in range(1, 5):
+            self._positions[i] = max(self._positions[i], self._positions[i - 1] + 1)
+        for i in range(3, -1, -1):
+            self._positions[i] = min(self._positions[i], self._positions[i + 1] - 1)
+        self._heights = [float(ordered[n - 1]) for n in self._positions]
+
+    def update(self, x):
+        self.count += 1
+        if self._heights is None:
+            self._initial.append(x)
+            if len(self._initial) == 5:
+                self._heights = sorted(self._initial)
+            return
+        q, n = self._heights, self._positions
+        if x < q[0]:
+            q[0] = x
+            k = 0
+        elif x >= q[4]:
+            q[4] = x
+            k = 3
+        else:
+            k = 0
+            while x >= q[k + 1]:
+                k += 1
+        for i in range(k + 1, 5):
+            n[i] += 1
+        for i in range(5):
+            self._desired[i] += self._increments[i]
+        for i in range(1, 4):
+            d = self._desired[i] - n[i]
+            if d >= 1 and n[i + 1] - n[i] > 1 or d <= -1 and n[i - 1] - n[i] < -1:
+                d = 1 if d > 0 else -1
+                height = q[i] + d / (n[i + 1] - n[i - 1]) * (
+                        (n[i] - n[i - 1] + d) * (q[i + 1] - q[i]) / (n[i + 1] - n[i])
+                        + (n[i + 1] - n[i] - d) * (q[i] - q[i - 1]) / (n[i] - n[i - 1]))
+                if not q[i - 1] < height < q[i + 1]:
+                    height = q[i] + d * (q[i + d] - q[i]) / (n[i + d] - n[i])
+                q[i] = height
+                n[i] += d
+
+
+# Conditional value at risk of a return stream, as empyrical defines it: the mean of the
+# returns at or below the alpha quantile. The first exact_returns returns are kept and the
+# tail is computed exactly from them. Once that many have arrived, P2Quantile is seeded with
+# their order statistics and the tail sum with their exact tail, and from then on each return
+# at or below the estimated quantile is added as it arrives. With `decay` every return
+# scales the tail sum and weight by it, so old losses fade out with a half-life of
+# log(0.5) / log(decay) returns.
+class StreamingCVaR:
+    def __init__(self, alpha=CVAR_ALPHA, decay=None, exact_returns=CVAR_EXACT_RETURNS):
+        self.alpha = alpha
+        self.decay = decay
+        self.count = 0
+        self.quantile = P2Quantile(alpha)
+        self._tail_sum = 0.0
+        self._tail_weight = 0.0
+        self._returns = np.empty(max(exact_returns, CVAR_MIN_RETURNS))
+        self._exact = None
+
+    @property
+    def ready(self):
+        return self.count >= CVAR_MIN_RETURNS
+
+    def update(self, x):
+        if self._returns is not None:
+            self._returns[self.count] = x
+            self.count += 1
+            if self.count == len(self._returns):
+                self._hand_over()
+            return
+        self.count += 1
+        var = self.quantile.value
+        self.quantile.update(x)
+        if self.decay is not None:
+            self._tail_sum *= self.decay
+            self._tail_weight *= self.decay
+        if x <= var:
+            self._tail_sum += x
+            self._tail_weight += 1
+
+    # quantile, tail sum and tail weight of the kept returns, computed once per count
+    def _exact_tail(self):
+        if self._exact is None or self._exact[0] != self.count:
+            returns = self._returns[:self.count]
+            cutoff = int((self.count - 1) * self.alpha)
+            tail = np.argpartition(returns, cutoff)[:cutoff + 1]
+            if self.decay is None:
+                weights = np.ones(len(tail))
+            else:
+                weights = self.decay ** (self.count - 1 - tail)
+            self._exact = (
+                self.count,
+                float(returns[tail].max()),
+                float(returns[tail] @ weights),
+                float(weights.sum()),
+            )
+        return self._exact[1:]
+
+    def _hand_over(self):
+        _, self._tail_sum, self._tail_weight = self._exact_tail()
+        self.quantile.seed(np.sort(self._returns))
+        self._returns = None
+        self._exact = None
+
+    @property
+    def var(self):
+        if self._returns is not None:
+            return self._exact_tail()[0] if self.count else math.nan
+        return self.quantile.value
+
+    @property
+    def cvar(self):
+        if self._returns is not None:
+            if not self.count:
+                return math.nan
+            _, tail_sum, tail_weight = self._exact_tail()
+            return tail_sum / tail_weight
+        if not self._tail_weight:
+            return self.var
+        # the tail mean can never sit above the quantile it is the tail of
+        return min(self._tail_sum / self._tail_weight, self.var)
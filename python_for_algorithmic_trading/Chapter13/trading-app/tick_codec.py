@@ -0,0 +1,179 @@
+import struct
+import numpy as np
+from utils import TICK_DTYPE
+
+# Compact tick files. Prices are stored as integer multiples of 1 / price_scale (the ask as
+# the spread over the bid), sizes as integers. Every column is delta encoded, zigzag mapped
+# and bit-packed at the narrowest width that fits its block:
+#
+#     header  magic, version, price_scale, block_size
+#     blocks  count, then per column: first value (i8), bit width (u1), packed deltas
+#     index   one BLOCK_INDEX_DTYPE record per block
+#     footer  index offset, block count, magic
+#
+# The index lets a reader decode only the blocks overlapping a ts range.
+TICK_CODEC_MAGIC = b"TCK1"
+TICK_CODEC_VERSION = 1
+TICK_CODEC_BLOCK_SIZE = 8192
+# cents; use 10_000 for FX, 4 for quarter-point futures and so on
+TICK_CODEC_PRICE_SCALE = 100
+
+CODEC_COLUMNS = ["time", "ts", "bid", "spread", "bid_size", "ask_size"]
+
+BLOCK_INDEX_DTYPE = np.dtype([
+    ("first_ts", "<i8"),
+    ("last_ts", "<i8"),
+    ("offset", "<u8"),
+    ("count", "<u4"),
+])
+
+HEADER = struct.Struct("<4sBqI")
+BLOCK_HEADER = struct.Struct("<I")
+COLUMN_HEADER = struct.Struct("<qB")
+FOOTER = struct.Struct("<QI4s")
+
+
+def _zigzag(values):
+    return ((values << 1) ^ (values >> 63)).view(np.uint64)
+
+
+def _unzigzag(values):
+    return ((values >> np.uint64(1)).view(np.int64)) ^ -(values & np.uint64(1)).view(np.int64)
+
+
+# the low `width` bits of every value, back to back
+def _pack(values, width):
+    if width == 0:
+        return b""
+    bits = np.unpackbits(values.astype("<u8").view(np.uint8), bitorder="little")
+    return np.packbits(bits.reshape(-1, 64)[:, :width], bitorder="little").tobytes()
+
+
+def _unpack(data, count, width):
+    if width == 0:
+        return np.zeros(count, dtype=np.uint64)
+    bits = np.unpackbits(
+            np.frombuffer(data, dtype=np.uint8), count=count * width, bitorder="little")
+    padded = np.zeros((count, 64), dtype=np.uint8)
+    padded[:, :width] = bits.reshape(count, width)
+    return np.packbits(padded, axis=1, bitorder="little").view("<u8").ravel()
+
+
+def _to_integers(values, scale, name):
+    scaled = np.rint(values * scale)
+    if not np.array_equal(scaled / scale, values):
+        raise ValueError(f"{name} not representable at a scale of {scale}")
+    return scaled.astype(np.int64)
+
+
+def _columns(batch, price_scale):
+    bid = _to_integers(batch["bid_price"], price_scale, "bid_price")
+    ask = _to_integers(batch["ask_price"], price_scale, "ask_price")
+    return [
+        batch["time"].astype(np.int64),
+        batch["ts"].astype(np.int64),
+        bid,
+        ask - bid,
+        _to_integers(batch["bid_size"], 1, "bid_size"),
+        _to_integers(batch["ask_size"], 1, "ask_size"),
+    ]
+
+
+def _encode_block(columns, start, end):
+    parts = [BLOCK_HEADER.pack(end - start)]
+    for values in columns:
+        block = values[start:end]
+        deltas = _zigzag(np.diff(block))
+        width = int(deltas.max()).bit_length() if len(deltas) else 0
+        parts.append(COLUMN_HEADER.pack(int(block[0]), width))
+        parts.append(_pack(deltas, width))
+    return b"".join(parts)
+
+
+def encode_ticks(batch, price_scale=TICK_CODEC_PRICE_SCALE, block_size=TICK_CODEC_BLOCK_SIZE):
+    columns = _columns(batch, price_scale)
+    parts = [HEADER.pack(TICK_CODEC_MAGIC, TICK_CODEC_VERSION, price_scale, block_size)]
+    offset = HEADER.size
+    index = np.zeros((len(batch) + block_size - 1) // block_size, dtype=BLOCK_INDEX_DTYPE)
+    for i, start in enumerate(range(0, len(batch), block_size)):
+        end = min(start + block_size, len(batch))
+        block = _encode_block(columns, start, end)
+        index[i] = (columns[1][start:end].min(), columns[1][start:end].max(), offset, end - start)
+        parts.append(block)
+        offset += len(block)
+    parts.append(index.tobytes())
+    parts.append(FOOTER.pack(offset, len(index), TICK_CODEC_MAGIC))
+    return b"".join(parts)
+
+
+def read_header(data):
+    magic, version, price_scale, block_size = HEADER.unpack_from(data)
+    if magic != TICK_CODEC_MAGIC or version != TICK_CODEC_VERSION:
+        raise ValueError("not a tick codec file")
+    return price_scale, block_size
+
+
+def read_index(data):
+    index_offset, blocks, magic = FOOTER.unpack_from(data, len(data) - FOOTER.size)
+    if magic != TICK_CODEC_MAGIC:
+        raise ValueError("truncated tick codec file")
+    return np.frombuffer(data, dtype=BLOCK_INDEX_DTYPE, count=blocks, offset=index_offset)
+
+
+def _decode_block(data, offset, out, price_scale):
+    count, = BLOCK_HEADER.unpack_from(data, offset)
+    offset += BLOCK_HEADER.size
+    columns = []
+    for _ in CODEC_COLUMNS:
+        first, width = COLUMN_HEADER.unpack_from(data, offset)
+        offset += COLUMN_HEADER.size
+        size = ((count - 1) * width + 7) // 8
+        values = np.empty(count, dtype=np.int64)
+        values[0] = first
+        np.cumsum(_unzigzag(_unpack(data[offset:offset + size], count - 1, width)),
+                  out=values[1:])
+        values[1:] += first
+        offset += size
+        columns.append(values)
+    time, ts, bid, spread, bid_size, ask_size = columns
+    out["time"] = time
+    out["ts"] = ts
+    out["bid_price"] = bid / price_scale
+    out["ask_price"] = (bid + spread) / price_scale
+    out["bid_size"] = bid_size
+    out["ask_size"] = ask_size
+
+
+# TICK_DTYPE records; with start/end only blocks overlapping [start, end) on ts are decoded
+# and the result is trimmed to the range
+def decode_ticks(data, start=None, end=None):
+    data = memoryview(data)
+    price_scale, _ = read_header(data)
+    index = read_index(data)
+    selected = np.ones(len(index), dtype=bool)
+    if start is not None:
+        selected &= index["last_ts"] >= start
+    if end is not None:
+        selected &= index["first_ts"] < end
+    blocks = index[selected]
+    out = np.empty(int(blocks["count"].sum()), dtype=TICK_DTYPE)
+    position = 0
+    for offset, count in zip(blocks["offset"].tolist(), blocks["count"].tolist()):
+        _decode_block(data, offset, out[position:position + count], price_scale)
+        position += count
+    if start is not None:
+        out = out[out["ts"] >= start]
+    if end is not None:
+        out = out[out["ts"] < end]
+    return out
+
+
+def write_tick_file(path, batch, price_scale=TICK_CODEC_PRICE_SCALE,
+                    block_size=TICK_CODEC_BLOCK_SIZE):
+    with open(path, "wb") as f:
+        f.write(encode_ticks(batch, price_scale, block_size))
+
+
+def read_tick_file(path, start=None, end=None):
+    with open(path, "rb") as f:
+        return decode_ticks(f.read(), start, end)
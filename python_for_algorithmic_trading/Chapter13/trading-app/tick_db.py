@@ -0,0 +1,183 @@
+import numpy as np
+import pandas as pd
+from bar_cache import bar_size_seconds
+from utils import CREATE_BID_ASK_DATA, TICK_DTYPE
+
+# bid_ask_data schema versions, the current one is kept in PRAGMA user_version
+#   0  timestamp as "%Y-%m-%d %H:%M:%S" text, no index
+#   1  ts as integer epoch nanoseconds of receipt, TWS' whole-second time kept as
+#      exchange_time, indexed on (symbol, ts)
+#   2  tick_bars rolled up from bid_ask_data by BarRollup, rollup_state its watermark
+TICK_SCHEMA_VERSION = 2
+
+MIGRATIONS = {
+    1: [
+        CREATE_BID_ASK_DATA,
+        "ALTER TABLE bid_ask_data RENAME TO bid_ask_data_v0",
+        """
+        CREATE TABLE bid_ask_data
+        (
+            ts INTEGER NOT NULL,
+            exchange_time INTEGER NOT NULL,
+            symbol TEXT NOT NULL,
+            bid_price REAL,
+            ask_price REAL,
+            bid_size INTEGER,
+            ask_size INTEGER
+        )""",
+        """
+        INSERT INTO bid_ask_data
+        SELECT
+            CAST(strftime('%s', timestamp) AS INTEGER) * 1000000000,
+            CAST(strftime('%s', timestamp) AS INTEGER),
+            symbol, bid_price, ask_price, bid_size, ask_size
+        FROM bid_ask_data_v0
+        WHERE timestamp IS NOT NULL
+        ORDER BY rowid""",
+        "DROP TABLE bid_ask_data_v0",
+        "CREATE INDEX bid_ask_data_symbol_ts ON bid_ask_data (symbol, ts)",
+    ],
+    2: [
+        """
+        CREATE TABLE tick_bars
+        (
+            symbol TEXT NOT NULL,
+            resolution INTEGER NOT NULL,
+            ts INTEGER NOT NULL,
+            open REAL,
+            high REAL,
+            low REAL,
+            close REAL,
+            spread REAL,
+            spread_max REAL,
+            ticks INTEGER,
+            first_ts INTEGER,
+            last_ts INTEGER,
+            PRIMARY KEY (symbol, resolution, ts)
+        ) WITHOUT ROWID""",
+        """
+        CREATE TABLE rollup_state
+        (
+            name TEXT PRIMARY KEY,
+            last_rowid INTEGER NOT NULL
+        )""",
+    ],
+}
+
+# one row per TICK_DTYPE record followed by the symbol
+INSERT_TICK = """
+    INSERT INTO bid_ask_data
+        (exchange_time, bid_price, ask_price, bid_size, ask_size, ts, symbol)
+    VALUES (?, ?, ?, ?, ?, ?, ?)"""
+
+SELECT_TICKS = """
+    SELECT ts, exchange_time, bid_price, ask_price, bid_size, ask_size
+    FROM bid_ask_data
+    WHERE symbol = :symbol AND ts >= :start AND ts < :end
+    ORDER BY ts"""
+
+# midpoint bars, buckets are aligned to the epoch; open and close come from the first and
+# last tick of each bucket, found through the (symbol, ts) index
+SELECT_BARS = """
+    SELECT
+        bucket * :size AS ts,
+        (SELECT (bid_price + ask_price) / 2 FROM bid_ask_data
+         WHERE symbol = :symbol AND ts = first_ts ORDER BY rowid LIMIT 1) AS open,
+        high,
+        low,
+        (SELECT (bid_price + ask_price) / 2 FROM bid_ask_data
+         WHERE symbol = :symbol AND ts = last_ts ORDER BY rowid DESC LIMIT 1) AS close,
+        ticks
+    FROM (
+        SELECT
+            ts / :size AS bucket,
+            MIN(ts) AS first_ts,
+            MAX(ts) AS last_ts,
+            MAX((bid_price + ask_price) / 2) AS high,
+            MIN((bid_price + ask_price) / 2) AS low,
+            COUNT(*) AS ticks
+        FROM bid_ask_data
+        WHERE symbol = :symbol AND ts >= :start AND ts < :end
+        GROUP BY bucket
+    )
+    ORDER BY bucket"""
+
+SELECT_ROLLUP_BARS = """
+    SELECT ts, open, high, low, close, spread, spread_max, ticks
+    FROM tick_bars
+    WHERE symbol = :symbol AND resolution = :resolution AND ts >= :start AND ts < :end
+    ORDER BY ts"""
+
+TICK_COLUMNS = ["ts", "exchange_time", "bid_price", "ask_price", "bid_size", "ask_size"]
+BAR_COLUMNS = ["ts", "open", "high", "low", "close", "ticks"]
+ROLLUP_BAR_COLUMNS = ["ts", "open", "high", "low", "close", "spread", "spread_max", "ticks"]
+
+
+def schema_version(connection):
+    return connection.execute("PRAGMA user_version").fetchone()[0]
+
+
+# bring bid_ask_data up to TICK_SCHEMA_VERSION, each step in its own transaction
+def migrate(connection):
+    version = schema_version(connection)
+    for target in range(version + 1, TICK_SCHEMA_VERSION + 1):
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            if schema_version(connection) >= target:
+                connection.execute("ROLLBACK")
+                continue
+            for statement in MIGRATIONS[target]:
+                connection.execute(statement)
+            connection.execute(f"PRAGMA user_version = {target}")
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+    return schema_version(connection)
+
+
+# epoch nanoseconds from anything pd.Timestamp accepts, naive values are taken as UTC
+def to_epoch_ns(value):
+    if isinstance(value, (int, np.integer)):
+        return int(value)
+    return pd.Timestamp(value).value
+
+
+def _frame(rows, columns):
+    frame = pd.DataFrame.from_records(rows, columns=columns)
+    frame.index = pd.to_datetime(frame.pop("ts"), unit="ns")
+    return frame
+
+
+# the ticks of a symbol with start <= ts < end, or midpoint bars of bar_size ("1 min",
+# "5 secs", ...) computed by SQLite so only the bars leave the database
+def query_ticks(connection, symbol, start, end, bar_size=None):
+    params = {"symbol": symbol, "start": to_epoch_ns(start), "end": to_epoch_ns(end)}
+    if bar_size is None:
+        return _frame(connection.execute(SELECT_TICKS, params).fetchall(), TICK_COLUMNS)
+    params["size"] = bar_size_seconds(bar_size) * 1_000_000_000
+    return _frame(connection.execute(SELECT_BARS, params).fetchall(), BAR_COLUMNS)
+
+
+# bars kept up to date by BarRollup, bar_size must be one of its resolutions
+def query_bars(connection, symbol, start, end, bar_size):
+    params = {
+        "symbol": symbol,
+        "resolution": bar_size_seconds(bar_size),
+        "start": to_epoch_ns(start),
+        "end": to_epoch_ns(end),
+    }
+    return _frame(connection.execute(SELECT_ROLLUP_BARS, params).fetchall(), ROLLUP_BAR_COLUMNS)
+
+
+# the same ticks as TICK_DTYPE records, e.g. for tick_codec.write_tick_file
+def query_tick_array(connection, symbol, start, end):
+    params = {"symbol": symbol, "start": to_epoch_ns(start), "end": to_epoch_ns(end)}
+    rows = np.array(
+            connection.execute(SELECT_TICKS, params).fetchall(),
+            dtype=[(name, TICK_DTYPE[name if name != "exchange_time" else "time"])
+                   for name in TICK_COLUMNS])
+    batch = np.empty(len(rows), dtype=TICK_DTYPE)
+    for name in TICK_DTYPE.names:
+        batch[name] = rows[name if name != "time" else "exchange_time"]
+    return batch
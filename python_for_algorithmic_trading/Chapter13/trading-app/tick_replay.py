@@ -0,0 +1,84 @@
+import time
+import numpy as np
+from tick_stream import STREAM_TICK_DTYPE
+from utils import TICK_DTYPE, Tick
+
+REPLAY_BATCH_SIZE = 65536
+# with a replay speed, batches span at most this much wall-clock time
+REPLAY_PACE_INTERVAL = 0.05
+
+
+# replay files are TICK_DTYPE .npy arrays sorted by ts, so they can be memory-mapped
+def save_replay_file(path, batch):
+    np.save(path, batch[np.argsort(batch["ts"], kind="stable")].astype(TICK_DTYPE))
+
+
+# Recorded ticks fed back the way they arrived live. Every symbol's file is memory-mapped
+# and walked in time-aligned windows: `windows` yields zero-copy views per symbol,
+# `batches` the same ticks merged in ts order and tagged with `contract_id` exactly like
+# TickStream.batches, and `ticks` one Tick at a time like get_streaming_data. With a
+# `speed` the replay sleeps to keep market time at `speed` times wall-clock time,
+# otherwise it runs flat out.
+class TickReplay:
+    def __init__(self, sources, speed=None, start=None, end=None, batch_size=REPLAY_BATCH_SIZE):
+        self.symbols = list(sources)
+        self.speed = speed
+        self.batch_size = batch_size
+        self._arrays = []
+        for source in sources.values():
+            ticks = np.load(source, mmap_mode="r") if isinstance(source, str) else source
+            first = 0 if start is None else np.searchsorted(ticks["ts"], start)
+            last = len(ticks) if end is None else np.searchsorted(ticks["ts"], end)
+            self._arrays.append(ticks[first:last])
+
+    def __len__(self):
+        return sum(len(ticks) for ticks in self._arrays)
+
+    def windows(self):
+        positions = [0] * len(self._arrays)
+        replay_start = wall_start = None
+        while True:
+            active = [i for i, ticks in enumerate(self._arrays) if positions[i] < len(ticks)]
+            if not active:
+                return
+            # no symbol contributes more than batch_size ticks to a window
+            horizon = min(
+                    ticks["ts"][min(positions[i] + self.batch_size, len(ticks)) - 1]
+                    for i, ticks in enumerate(self._arrays) if i in active)
+            if self.speed is not None:
+                window_start = min(self._arrays[i]["ts"][positions[i]] for i in active)
+                if replay_start is None:
+                    replay_start, wall_start = window_start, time.monotonic()
+                delay = (window_start - replay_start) / 1e9 / self.speed \
+                    - (time.monotonic() - wall_start)
+                if delay > 0:
+                    time.sleep(delay)
+                horizon = min(horizon, window_start + int(REPLAY_PACE_INTERVAL * self.speed * 1e9))
+            window = []
+            for i in active:
+                position = positions[i]
+                ticks = self._arrays[i][position:position + self.batch_size]
+                count = int(np.searchsorted(ticks["ts"], horizon, side="right"))
+                if count:
+                    window.append((i, ticks[:count]))
+                    positions[i] += count
+            yield window
+
+    def batches(self):
+        for window in self.windows():
+            batch = np.empty(sum(len(ticks) for _, ticks in window), dtype=STREAM_TICK_DTYPE)
+            position = 0
+            for contract_id, ticks in window:
+                part = batch[position:position + len(ticks)]
+                for name in TICK_DTYPE.names:
+                    part[name] = ticks[name]
+                part["contract_id"] = contract_id
+                position += len(ticks)
+            if len(window) > 1:
+                batch = batch[np.argsort(batch["ts"], kind="stable")]
+            yield batch
+
+    # for a single symbol this is a drop-in for get_streaming_data, contract_id is dropped
+    def ticks(self):
+        for batch in self.batches():
+            yield from map(Tick._make, batch[list(TICK_DTYPE.names)].tolist())
@@ -0,0 +1,203 @@
+import os
+import threading
+import time
+import uuid
+import numpy as np
+from tick_db import to_epoch_ns
+from utils import TICK_DTYPE
+
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+TICK_STORE_PATH = "ticks"
+# a partition's open file is closed and a new one started after this many rows or seconds
+TICK_STORE_FILE_ROWS = 5_000_000
+TICK_STORE_FILE_SECONDS = 3600
+# rows buffered per partition before they are written out as one row group
+TICK_STORE_ROW_GROUP = 100_000
+
+# files still being written start with "_", dataset discovery skips them
+IN_PROGRESS_PREFIX = "_"
+
+
+def _require_pyarrow():
+    if pa is None:
+        raise ImportError("ParquetTickStore needs pyarrow, pip install pyarrow")
+
+
+def _partition_dir(root, symbol, date):
+    return os.path.join(root, f"symbol={symbol}", f"date={date}")
+
+
+def _dates(times):
+    return np.datetime_as_string(times.astype("datetime64[s]"), unit="D")
+
+
+# Captured ticks as Parquet files partitioned by symbol and UTC date:
+#
+#     ticks/symbol=AAPL/date=2024-05-01/part-<id>.parquet
+#
+# Every partition being written has one open file that takes a row group per
+# TICK_STORE_ROW_GROUP rows and is rotated after file_rows rows or file_seconds, the age
+# of every open file is checked on each write.
+# compact() merges the closed files of a partition into one, in arrival (ts) order. Reads go
+# through pyarrow.dataset, so the symbol and date filters prune whole directories and the
+# ts filter is checked against row group statistics before anything is decoded.
+class ParquetTickStore:
+    def __init__(
+            self,
+            root=TICK_STORE_PATH,
+            file_rows=TICK_STORE_FILE_ROWS,
+            file_seconds=TICK_STORE_FILE_SECONDS,
+            row_group=TICK_STORE_ROW_GROUP
+    ):
+        _require_pyarrow()
+        self.root = root
+        self.file_rows = file_rows
+        self.file_seconds = file_seconds
+        self.row_group = row_group
+        self.schema = pa.schema(
+                [(name, pa.from_numpy_dtype(TICK_DTYPE[name])) for name in TICK_DTYPE.names])
+        self.partitioning = ds.partitioning(
+                pa.schema([("symbol", pa.string()), ("date", pa.string())]), flavor="hive")
+        self._lock = threading.Lock()
+        # (symbol, date) -> [writer, path, rows written, opened at, pending batches, pending rows]
+        self._open = {}
+
+    def write(self, symbol, batch):
+        if not len(batch):
+            return
+        dates = _dates(batch["time"])
+        with self._lock:
+            for date in np.unique(dates):
+                part = batch[dates == date] if dates[0] != dates[-1] else batch
+                self._append(symbol, str(date), part)
+            self._rotate_expired()
+
+    def _append(self, symbol, date, batch):
+        entry = self._open.get((symbol, date))
+        if entry is None:
+            directory = _partition_dir(self.root, symbol, date)
+            os.makedirs(directory, exist_ok=True)
+            path = os.path.join(directory, f"{IN_PROGRESS_PREFIX}part-{uuid.uuid4().hex}.parquet")
+            writer = pq.ParquetWriter(path, self.schema)
+            entry = self._open[(symbol, date)] = [writer, path, 0, time.monotonic(), [], 0]
+        entry[4].append(batch)
+        entry[5] += len(batch)
+        if entry[5] >= self.row_group:
+            self._write_pending(entry)
+        if entry[2] >= self.file_rows:
+            self._rotate(symbol, date)
+
+    # files are rotated on age whether or not their partition still gets ticks, so a symbol
+    # that stops trading or yesterday's date does not stay hidden from readers
+    def _rotate_expired(self):
+        now = time.monotonic()
+        for (symbol, date), entry in list(self._open.items()):
+            if now - entry[3] >= self.file_seconds:
+                self._rotate(symbol, date)
+
+    def _write_pending(self, entry):
+        if not entry[5]:
+            return
+        batch = np.concatenate(entry[4])
+        entry[0].write_table(
+                pa.table({name: batch[name] for name in TICK_DTYPE.names}, schema=self.schema))
+        entry[2] += len(batch)
+        entry[4] = []
+        entry[5] = 0
+
+    def _rotate(self, symbol, date):
+        writer, path, _, _, _, _ = entry = self._open.pop((symbol, date))
+        self._write_pending(entry)
+        writer.close()
+        directory, name = os.path.split(path)
+        os.replace(path, os.path.join(directory, name[len(IN_PROGRESS_PREFIX):]))
+
+    # close every open file, its ticks become visible to readers
+    def flush(self):
+        with self._lock:
+            for symbol, date in list(self._open):
+                self._rotate(symbol, date)
+
+    close = flush
+
+    # merge the closed files of each partition into one file sorted by ts, then time
+    def compact(self, symbol=None, date=None):
+        compacted = 0
+        for directory in self._partition_dirs(symbol, date):
+            parts = sorted(
+                    name for name in os.listdir(directory)
+                    if name.endswith(".parquet") and not name.startswith(IN_PROGRESS_PREFIX))
+            if len(parts) < 2:
+                continue
+            paths = [os.path.join(directory, name) for name in parts]
+            table = pa.concat_tables(pq.read_table(path, schema=self.schema) for path in paths)
+            table = table.sort_by([("ts", "ascending"), ("time", "ascending")])
+            name = f"part-{uuid.uuid4().hex}.parquet"
+            pq.write_table(
+                    table, os.path.join(directory, IN_PROGRESS_PREFIX + name),
+                    row_group_size=self.row_group)
+            os.replace(
+                    os.path.join(directory, IN_PROGRESS_PREFIX + name),
+                    os.path.join(directory, name))
+            for path in paths:
+                os.remove(path)
+            compacted += 1
+        return compacted
+
+    def _partition_dirs(self, symbol=None, date=None):
+        if not os.path.isdir(self.root):
+            return
+        for symbol_dir in sorted(os.listdir(self.root)):
+            if symbol is not None and symbol_dir != f"symbol={symbol}":
+                continue
+            for date_dir in sorted(os.listdir(os.path.join(self.root, symbol_dir))):
+                if date is not None and date_dir != f"date={date}":
+                    continue
+                yield os.path.join(self.root, symbol_dir, date_dir)
+
+    def dataset(self):
+        schema = pa.unify_schemas([self.schema, self.partitioning.schema])
+        return ds.dataset(
+                self.root, schema=schema, format="parquet", partitioning=self.partitioning)
+
+    # ticks for the symbols with start <= ts < end as an Arrow table holding only the
+    # requested columns; bounds are epoch nanoseconds or anything tick_db.to_epoch_ns takes
+    def read(self, symbols=None, start=None, end=None, columns=None):
+        if isinstance(symbols, str):
+            symbols = [symbols]
+        if not os.path.isdir(self.root):
+            return pa.table(
+                    {name: pa.array([], self.schema.field(name).type)
+                     for name in columns or self.schema.names})
+        condition = None
+        for part in self._filters(symbols, start, end):
+            condition = part if condition is None else condition & part
+        return self.dataset().to_table(columns=columns, filter=condition)
+
+    # partitions follow TWS' whole-second time while the bounds are on the receipt ts, so
+    # the date pruning keeps a day either side
+    def _filters(self, symbols, start, end):
+        if symbols is not None:
+            yield ds.field("symbol").isin(list(symbols))
+        day = np.timedelta64(1, "D")
+        if start is not None:
+            start = to_epoch_ns(start)
+            yield ds.field("date") >= str(_dates(np.datetime64(start, "ns") - day))
+            yield ds.field("ts") >= start
+        if end is not None:
+            end = to_epoch_ns(end)
+            yield ds.field("date") <= str(_dates(np.datetime64(end, "ns") + day))
+            yield ds.field("ts") < end
+
+    def read_frame(self, symbols=None, start=None, end=None, columns=None):
+        frame = self.read(symbols, start, end, columns).to_pandas()
+        order = [name for name in ("ts", "time") if name in frame]
+        if order:
+            frame = frame.sort_values(order, kind="stable", ignore_index=True)
+        return frame
@@ -0,0 +1,125 @@
+import threading
+import numpy as np
+from ring_buffer import TickRingBuffer, TICK_BUFFER_CAPACITY
+from utils import TICK_DTYPE, contract_key
+
+# merged batches carry the stream's id for the contract each tick belongs to
+STREAM_TICK_DTYPE = np.dtype(TICK_DTYPE.descr + [("contract_id", "i4")])
+
+
+# One tick-by-tick subscription per contract, all waking a single consumer through a
+# shared condition. Each contract has its own bounded ring buffer, so a busy symbol can
+# only overflow (and count) its own ticks. Batches are merged in arrival (ts) order and
+# tagged with `contract_id`, an index into `contracts`. Contracts can be added and removed while
+# the stream is being consumed. Set `on_ready` to be called from the EReader thread when
+# ticks become available, for consumers polling `take` instead of blocking in `batches`.
+class TickStream:
+    def __init__(self, client, capacity=TICK_BUFFER_CAPACITY):
+        self.capacity = capacity
+        self.contracts = {}
+        self.errors = {}
+        self._client = client
+        self._cond = threading.Condition()
+        self._subscriptions = {}
+        self._contract_ids = {}
+        self._next_contract_id = 0
+        self._closed = False
+        self.on_ready = None
+
+    @property
+    def closed(self):
+        return self._closed
+
+    @property
+    def overflows(self):
+        return {
+            self.contracts[contract_id].symbol: buffer.overflows
+            for contract_id, (request_id, buffer) in self._subscriptions.items()
+        }
+
+    def add(self, contract):
+        with self._cond:
+            key = contract_key(contract)
+            if key in self._contract_ids:
+                return self._contract_ids[key]
+            contract_id = self._next_contract_id
+            self._next_contract_id += 1
+            request_id = self._client.next_request_id()
+            buffer = TickRingBuffer(
+                    self.capacity, condition=self._cond, on_ready=self._ready)
+            self.contracts[contract_id] = contract
+            self._contract_ids[key] = contract_id
+            self._subscriptions[contract_id] = (request_id, buffer)
+        self._client.tick_buffers[request_id] = buffer
+        self._client.reqTickByTickData(
+                reqId=request_id,
+                contract=contract,
+                tickType="BidAsk",
+                numberOfTicks=0,
+                ignoreSize=True
+        )
+        return contract_id
+
+    def remove(self, contract):
+        with self._cond:
+            contract_id = self._contract_ids.pop(contract_key(contract), None)
+            subscription = self._subscriptions.pop(contract_id, None)
+        if subscription is not None:
+            self._client.stop_streaming_data(subscription[0])
+
+    def close(self):
+        with self._cond:
+            subscriptions = list(self._subscriptions.values())
+            self._subscriptions.clear()
+            self._contract_ids.clear()
+            self._closed = True
+            self._cond.notify_all()
+        self._ready()
+        for request_id, buffer in subscriptions:
+            self._client.stop_streaming_data(request_id)
+
+    def _ready(self):
+        if self.on_ready is not None:
+            self.on_ready()
+
+    def _pending(self):
+        return self._closed or any(
+                len(buffer) or buffer.closed for _, buffer in self._subscriptions.values())
+
+    # non-blocking: the merged batch queued so far (None if nothing) and whether the stream
+    # is closed. max_items caps how many ticks a single contract contributes to one batch.
+    def take(self, max_items=None):
+        with self._cond:
+            parts = []
+            for contract_id, (request_id, buffer) in list(self._subscriptions.items()):
+                ticks = buffer.take(max_items)
+                if len(ticks):
+                    part = np.empty(len(ticks), dtype=STREAM_TICK_DTYPE)
+                    for name in TICK_DTYPE.names:
+                        part[name] = ticks[name]
+                    part["contract_id"] = contract_id
+                    parts.append(part)
+                elif buffer.closed:
+                    # the subscription failed, keep streaming the other contracts; adding the
+                    # contract again subscribes afresh
+                    self.errors[contract_id] = buffer.error
+                    del self._subscriptions[contract_id]
+                    self._contract_ids.pop(contract_key(self.contracts[contract_id]), None)
+            closed = self._closed
+        if not parts:
+            return None, closed
+        batch = np.concatenate(parts)
+        return batch[np.argsort(batch["ts"], kind="stable")], closed
+
+    # blocks until any contract has ticks; with a timeout, empty batches are yielded too
+    def batches(self, max_items=None, timeout=None):
+        while True:
+            with self._cond:
+                self._cond.wait_for(self._pending, timeout)
+            batch, closed = self.take(max_items)
+            if batch is not None:
+                yield batch
+            elif closed:
+                return
+            elif timeout is not None:
+                yield np.empty(0, dtype=STREAM_TICK_DTYPE)
@@ -0,0 +1,60 @@
+from batch_worker import BatchWorker
+from tick_db import INSERT_TICK
+from utils import STRATEGY_DATABASE
+
+TICK_WRITER_BATCH_SIZE = 10_000
+TICK_WRITER_FLUSH_INTERVAL = 0.5
+# batches waiting to be written before `write` blocks the producer
+TICK_WRITER_MAX_QUEUE = 1024
+
+
+# Writes tick batches to bid_ask_data from a background thread. Producers hand over whole
+# TICK_DTYPE batches, the thread groups them into one executemany transaction once
+# batch_size rows are pending or flush_interval has passed. Rows of a failed transaction
+# are dropped and counted, see BatchWorker.
+class TickWriter(BatchWorker):
+    def __init__(
+            self,
+            path=STRATEGY_DATABASE,
+            batch_size=TICK_WRITER_BATCH_SIZE,
+            flush_interval=TICK_WRITER_FLUSH_INTERVAL,
+            max_queue=TICK_WRITER_MAX_QUEUE
+    ):
+        super().__init__(path, batch_size, flush_interval, max_queue)
+
+    def write(self, symbol, batch):
+        if not len(batch):
+            return
+        self._put((symbol, batch))
+
+    @property
+    def rows_written(self):
+        return self.items_written
+
+    @property
+    def rows_dropped(self):
+        return self.items_dropped
+
+    @property
+    def rows_per_second(self):
+        return self.items_written / self.busy_seconds if self.busy_seconds else 0.0
+
+    def stats(self):
+        return {
+            "queue_depth": self.queue_depth,
+            "rows_written": self.rows_written,
+            "rows_dropped": self.rows_dropped,
+            "transactions": self.transactions,
+            "failed_commits": self.failed_commits,
+            "last_error": self.last_error,
+            "rows_per_second": self.rows_per_second,
+        }
+
+    def _size(self, item):
+        return len(item[1])
+
+    def _commit(self, connection, batches):
+        with connection:
+            for symbol, batch in batches:
+                connection.executemany(
+                        INSERT_TICK, [tick + (symbol,) for tick in batch.tolist()])
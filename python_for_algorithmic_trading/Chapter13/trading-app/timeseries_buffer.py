@@ -0,0 +1,59 @@
+import threading
+import numpy as np
+import pandas as pd
+
+TIMESERIES_CAPACITY = 1 << 17
+
+
+# The last `capacity` (time, value) points of a series in preallocated arrays. Every point
+# is written twice, at i and i + capacity, so the most recent points are always one
+# contiguous slice: appends are O(1), memory stays fixed however long the session runs,
+# and `series` wraps the slice without copying.
+class TimeSeriesBuffer:
+    def __init__(self, capacity=TIMESERIES_CAPACITY):
+        self.capacity = capacity
+        self._times = np.zeros(2 * capacity, dtype="datetime64[ns]")
+        self._values = np.full(2 * capacity, np.nan)
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return min(self._count, self.capacity)
+
+    def append(self, time, value):
+        time = np.datetime64(pd.Timestamp(time).value, "ns")
+        with self._lock:
+            i = self._count % self.capacity
+            self._times[i] = self._times[i + self.capacity] = time
+            self._values[i] = self._values[i + self.capacity] = value
+            self._count += 1
+
+    def _slice(self):
+        if self._count <= self.capacity:
+            return slice(0, self._count)
+        end = (self._count - 1) % self.capacity + self.capacity + 1
+        return slice(end - self.capacity, end)
+
+    @property
+    def values(self):
+        view = self._values[self._slice()]
+        view.flags.writeable = False
+        return view
+
+    @property
+    def times(self):
+        view = self._times[self._slice()]
+        view.flags.writeable = False
+        return view
+
+    @property
+    def last(self):
+        return self._values[(self._count - 1) % self.capacity] if self._count else None
+
+    # read-only pandas view of the buffered points; it aliases the buffer and once the buffer
+    # is full new points overwrite the view's oldest ones, take a copy to keep it
+    def series(self, name=None):
+        with self._lock:
+            times, values = self.times, self.values
+        return pd.Series(
+                values, index=pd.DatetimeIndex(times, copy=False), name=name, copy=False)
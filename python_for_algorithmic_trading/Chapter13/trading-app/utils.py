@@ -1,33 +1,101 @@
+import numpy as np
 import pandas as pd
-from dataclasses import dataclass, field
+from typing import NamedTuple
 
 TRADE_BAR_PROPERTIES = ["time", "open", "high", "low", "close", "volume"]
 DEFAULT_MARKET_DATA_ID = 55
+ACCOUNT_PNL_ID = 99
+HISTORICAL_DATA_TIMEOUT = 60
+CONTRACT_DETAILS_TIMEOUT = 10
+# request ids handed out automatically start here, clear of the hand-picked ids above and of
+# order ids, which TWS reports errors under too and which grow from 1 per account
+REQUEST_ID_START = 1 << 30
 
-@dataclass
-class Tick:
-    time : int
+ORDER_DONE_STATUSES = {"Filled", "Cancelled", "ApiCancelled", "Inactive"}
+
+# error codes TWS sends as informational messages, they must not fail a pending request
+WARNING_CODES = set(range(2100, 2200)) | {10167}
+
+STRATEGY_DATABASE = "strategy_1.sqlite"
+
+# bar dates come back as dates for daily and longer bars, as timestamps with a time zone otherwise
+def parse_bar_times(values, bar_size):
+    bar_sizes = ["day", "D", "week", "W", "month"]
+    if any(x in bar_size for x in bar_sizes):
+        fmt = "%Y%m%d"
+    else:
+        fmt = "%Y%m%d %H:%M:%S %Z"
+    return pd.to_datetime(values, format=fmt)
+
+# identifies a contract across requests, the conId once IB has resolved it
+def contract_key(contract):
+    if contract.conId:
+        return str(contract.conId)
+    return "|".join(
+        str(x) for x in (
+            contract.symbol,
+            contract.secType,
+            contract.exchange,
+            contract.currency,
+            contract.lastTradeDateOrContractMonth,
+            contract.strike,
+            contract.right,
+        )
+    )
+
+class IBError(Exception):
+    def __init__(self, request_id, error_code, error_string):
+        super().__init__(f"request {request_id}: [{error_code}] {error_string}")
+        self.request_id = request_id
+        self.error_code = error_code
+        self.error_string = error_string
+
+# one tick as handed out by get_streaming_data; only plain numbers are stored, the
+# pandas timestamp is built when asked for
+class Tick(NamedTuple):
+    time: int
     bid_price: float
     ask_price: float
     bid_size: float
     ask_size: float
-    timestamp_: pd.Timestamp = field(init=False)
-    def __post_init_(self):
-        self.timestamp_ = pd.to_datetime(self.time, unit="s")
-        self.bid_price = float(self.bid_price)
-        self.ask_price = float(self.ask_price)
-        self.bid_size = int(self.bid_size)
-        self.ask_size = int(self.ask_size)
+    ts: int = 0
 
+    @property
+    def timestamp_(self):
+        if self.ts:
+            return pd.Timestamp(self.ts, unit="ns")
+        return pd.Timestamp(self.time, unit="s")
+
+# one tick-by-tick bid/ask update, as stored in the per-subscription ring buffers; TWS
+# only sends whole seconds in `time`, `ts` is when the tick arrived in epoch nanoseconds
+TICK_DTYPE = np.dtype([
+    ("time", "i8"),
+    ("bid_price", "f8"),
+    ("ask_price", "f8"),
+    ("bid_size", "f8"),
+    ("ask_size", "f8"),
+    ("ts", "i8"),
+])
+
+
+# a batch of TICK_DTYPE records as a DataFrame indexed by arrival time, for the edges
+# where pandas is wanted
+def ticks_to_frame(batch):
+    frame = pd.DataFrame({name: batch[name] for name in TICK_DTYPE.names if name != "ts"})
+    frame.index = pd.to_datetime(batch["ts"], unit="ns")
+    frame.index.name = "ts"
+    return frame
+
+# the original bid_ask_data schema, tick_db.migrate upgrades it
 CREATE_BID_ASK_DATA = """
     CREATE TABLE IF NOT EXISTS bid_ask_data
         (
             timestamp DATETIME,
-            symbol, STRING,
+            symbol STRING,
             bid_price REAL,
-            ask_price, REAL,
-            bid_size, INTEGER,
-            ask_size, INTEGER
+            ask_price REAL,
+            bid_size INTEGER,
+            ask_size INTEGER
         )"""
 
 CREATE_OPEN_ORDERS = """
@@ -57,3 +125,13 @@ CREATE_TRADES = """
         quantity INTEGER,
         last_liquidity REAL
     )"""
+
+INSERT_OPEN_ORDER = """
+    INSERT INTO open_orders
+        (order_id, symbol, sec_type, exchange, action, order_type, quantity, status)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)"""
+
+INSERT_TRADE = """
+    INSERT INTO trades
+        (request_id, symbol, sec_type, currency, execution_id, order_id, quantity, last_liquidity)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)"""
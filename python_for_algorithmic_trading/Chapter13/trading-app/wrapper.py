@@ -1,21 +1,78 @@
+from time import time_ns
 from ibapi.wrapper import EWrapper
-import threading
+from market_data import MarketDataCache
+from account_state import AccountState
+from order_ids import OrderIdSequence
+from risk_engine import RiskEngine
+from utils import (
+        IBError,
+        WARNING_CODES,
+        ORDER_DONE_STATUSES,
+        TRADE_BAR_PROPERTIES,
+        INSERT_OPEN_ORDER,
+        INSERT_TRADE,
+        parse_bar_times
+)
 
 class IBWrapper(EWrapper):
     def __init__(self):
         EWrapper.__init__(self)
         self.historical_data = {}
-        self.streaming_data = {}
-        self.stream_event = threading.Event()
+        self.contract_details = {}
+        self.request_futures = {}
+        self.live_bars = {}
+        self.market_data = MarketDataCache()
+        self.tick_buffers = {}
         self.nextValidOrderId = None
-        self.account_values = {}
-        self.positions = {}
-        self.account_pnl = {}
+        self.order_ids = OrderIdSequence()
+        self.open_orders = {}
+        self.account_state = AccountState()
+        self.account_values = self.account_state.account_values
+        self.positions = self.account_state.positions
+        self.account_pnl = self.account_state.pnl
+        self.risk = RiskEngine()
         self.portfolio_returns = None
         
+    # complete the future the client is waiting on for a request id
+    def _resolve_request(self, request_id, result):
+        future = self.request_futures.pop(request_id, None)
+        if future is not None and not future.done():
+            future.set_result(result)
+
+    def _fail_request(self, request_id, exception):
+        future = self.request_futures.pop(request_id, None)
+        if future is not None and not future.done():
+            future.set_exception(exception)
+
+    def error(self, request_id, error_code, error_string, advanced_order_reject_json=""):
+        if error_code in WARNING_CODES:
+            return
+        print("Error:", request_id, error_code, error_string)
+        # order errors (201 rejected, 202 cancelled, ...) carry the order id, which may equal
+        # a request id, they must not fail the request or subscription with that id
+        if self.order_ids.lookup(request_id) is not None or request_id in self.open_orders:
+            return
+        exception = IBError(request_id, error_code, error_string)
+        self.historical_data.pop(request_id, None)
+        self._fail_request(request_id, exception)
+        self.market_data.fail(request_id, exception)
+        if request_id in self.tick_buffers:
+            self.tick_buffers.pop(request_id).close(exception)
+
+    # orders placed but not yet filled or cancelled, with their signed remaining quantity
+    def _track_order(self, order_id, contract, order, status="PendingSubmit"):
+        sign = 1 if order.action == "BUY" else -1
+        self.open_orders[order_id] = {
+                "contract": contract,
+                "symbol": contract.symbol,
+                "remaining": sign * float(order.totalQuantity),
+                "status": status,
+        }
+
     def nextValidId(self, order_id):
         super().nextValidId(order_id)
         self.nextValidOrderId = order_id
+        self.order_ids.seed(order_id)
 
     def orderStatus(
             self,
@@ -31,6 +88,14 @@ class IBWrapper(EWrapper):
             why_held,
             mkt_cap_price,
     ):
+        if order_id in self.open_orders:
+            if status in ORDER_DONE_STATUSES:
+                del self.open_orders[order_id]
+            else:
+                tracked = self.open_orders[order_id]
+                sign = 1 if tracked["remaining"] >= 0 else -1
+                tracked["remaining"] = sign * float(remaining)
+                tracked["status"] = status
         print(
                 "orderStatus = orderid:",
                 order_id,
@@ -45,10 +110,9 @@ class IBWrapper(EWrapper):
         )
 
     def openOrder(self, order_id, contract, order, order_state):
-        cusor = self.connection.cursor()
-        query = "INSERT INTO open_orders(
-            order_id, symbol, sec_type, exchange, action, order_type, quantity, status)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)"
+        if order_id not in self.open_orders and order_state.status not in ORDER_DONE_STATUSES:
+            self._track_order(order_id, contract, order, order_state.status)
+        # journaled from a background thread, this runs on the message loop
         values = (
             order_id,
             contract.symbol,
@@ -56,10 +120,10 @@ class IBWrapper(EWrapper):
             contract.exchange,
             order.action,
             order.orderType,
-            order.totalQuantity,
+            float(order.totalQuantity),
             order_state.status
         )
-        cursor.execute(query, values)
+        self.journal.record(INSERT_OPEN_ORDER, values)
         print(
                 "openOrder id:",
                 order_id,
@@ -75,10 +139,6 @@ class IBWrapper(EWrapper):
         )
     
     def execDetails(self, request_id, contract, execution):
-        cusor = self.connection.cursor()
-        query = "INSERT INTO open_orders(
-            request_id, symbol, sec_type, currency, execution_id, order_id, quantity, last_liquidity)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)"
         values = (
             request_id,
             contract.symbol,
@@ -86,10 +146,10 @@ class IBWrapper(EWrapper):
             contract.currency,
             execution.execId,
             execution.orderId,
-            execution.shares,
+            float(execution.shares),
             execution.lastLiquidity
         )
-        cursor.execute(query, values)
+        self.journal.record(INSERT_TRADE, values)
 
         print(
                 "Order Executed: ",
@@ -104,6 +164,15 @@ class IBWrapper(EWrapper):
         )
 
 
+    def contractDetails(self, request_id, contract_details):
+        if request_id not in self.contract_details:
+            self.contract_details[request_id] = []
+        self.contract_details[request_id].append(contract_details)
+
+    def contractDetailsEnd(self, request_id):
+        self._resolve_request(
+                request_id, self.contract_details.pop(request_id, []))
+
     def historicalData(self, request_id, bar):
         bar_data = (
                 bar.date,
@@ -113,10 +182,32 @@ class IBWrapper(EWrapper):
                 bar.close,
                 bar.volume,
         )
-        if request_id not in self.historical_data.keys():
-            self.historical_data[request_id] = []
-        self.historical_data[request_id].append(
-                bar_data)
+        # requests register their list when sent, bars arriving after a cancel are dropped
+        bars = self.historical_data.get(request_id)
+        if bars is not None:
+            bars.append(bar_data)
+
+    def historicalDataEnd(self, request_id, start, end):
+        data = self.historical_data.pop(request_id, [])
+        # seed live frames here so the first update cannot race the initial bars
+        if request_id in self.live_bars:
+            live, symbol, bar_size = self.live_bars[request_id]
+            live.load(symbol, parse_bar_times([bar[0] for bar in data], bar_size),
+                      [bar[TRADE_BAR_PROPERTIES.index(live.col_to_use)] for bar in data])
+        self._resolve_request(request_id, data)
+
+    def historicalDataUpdate(self, request_id, bar):
+        if request_id not in self.live_bars:
+            return
+        live, symbol, bar_size = self.live_bars[request_id]
+        bar_time = parse_bar_times([bar.date], bar_size)
+        live.update(symbol, bar_time[0], getattr(bar, live.col_to_use))
+
+    def tickPrice(self, request_id, tick_type, price, attrib):
+        self.market_data.update(request_id, tick_type, float(price))
+
+    def tickSize(self, request_id, tick_type, size):
+        self.market_data.update(request_id, tick_type, float(size))
 
     def tickByTickBidAsk(
             self,
@@ -128,23 +219,24 @@ class IBWrapper(EWrapper):
             ask_size,
             tick_atrrib_last
     ):
-        tick_data = (
-                time,
-                bid_price,
-                ask_price,
-                bid_size,
-                ask_size,
-        )
-        self.streaming_data[request_id] = tick_data
-        self.stream_event.set()
+        buffer = self.tick_buffers.get(request_id)
+        if buffer is not None:
+            buffer.append(
+                    time,
+                    bid_price,
+                    ask_price,
+                    float(bid_size),
+                    float(ask_size),
+                    time_ns(),
+            )
 
     def updateAccountValue(self, key, val, currency, account):
         try:
             val_ = float(val)
         except:
             val_ = val
-        self.account_values[key] = (
-                val_, currency)
+        self.account_state.update(
+                "account_values", key, (val_, currency))
 
     def updatePortfolio(
             self,
@@ -167,7 +259,11 @@ class IBWrapper(EWrapper):
                 "unrealized_pnl": unrealized_pnl,
                 "realized_pnl": realized_pnl,
         }
-        self.positions[contract.symbol] = portfolio_data
+        self.account_state.update(
+                "positions", contract.symbol, portfolio_data)
+
+    def accountDownloadEnd(self, account_name):
+        self.account_state.mark_ready("account_values", "positions")
 
     def pnl(self, request_id, daily_pnl, unrealized_pnl, realized_pnl):
         pnl_data = {
@@ -175,5 +271,5 @@ class IBWrapper(EWrapper):
                 "unrealized_pnl": unrealized_pnl,
                 "realized_pnl": realized_pnl
         }
-        self.account_pnl[request_id] = pnl_data
+        self.account_state.update("pnl", request_id, pnl_data)
 